@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import json
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from benchmarks.corpus import CorpusSpec
+from benchmarks.runner import StageResult
+
+BASELINE_VERSION = 1
+
+
+class Comparison(NamedTuple):
+    stage: str
+    baseline: float
+    median: float
+    limit: float
+
+    @property
+    def change(self) -> float:
+        return self.median / self.baseline - 1 if self.baseline else 0.0
+
+    @property
+    def regressed(self) -> bool:
+        return self.median > self.limit
+
+
+def current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def workload(spec: CorpusSpec, change_ratio: float) -> dict:
+    return {"spec": spec._asdict(), "change_ratio": change_ratio}
+
+
+def save_baseline(
+    path: Path, results: list[StageResult], spec: CorpusSpec, change_ratio: float
+):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    baseline = {
+        "version": BASELINE_VERSION,
+        "created": datetime.now().isoformat(),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workload": workload(spec, change_ratio),
+        "stages": {
+            result.stage: {
+                "files": result.files,
+                "bytes": result.bytes,
+                "times": result.times,
+            }
+            for result in results
+        },
+    }
+    path.write_text(json.dumps(baseline, indent=4))
+
+
+def load_baseline(path: Path) -> dict:
+    baseline = json.loads(path.read_text())
+    if baseline.get("version") != BASELINE_VERSION:
+        raise ValueError(
+            f"Baseline {path} is version {baseline.get('version')}, "
+            f"expected {BASELINE_VERSION}."
+        )
+    return baseline
+
+
+def noise(times: list[float]) -> float:
+    """Median absolute deviation scaled to estimate the standard deviation."""
+    median = statistics.median(times)
+    return 1.4826 * statistics.median(abs(time - median) for time in times)
+
+
+def compare(
+    baseline: dict,
+    results: list[StageResult],
+    spec: CorpusSpec,
+    change_ratio: float,
+    threshold: float = 0.1,
+    deviations: float = 3.0,
+) -> list[Comparison]:
+    """Compares the medians of a run against a baseline of the same workload.
+
+    A stage regresses when its median exceeds the baseline median by more than
+    the threshold plus the given number of deviations of both runs, so noisy
+    stages need a larger slowdown to fail."""
+    if baseline["workload"] != json.loads(json.dumps(workload(spec, change_ratio))):
+        raise ValueError("Baseline was recorded with a different workload.")
+    comparisons = []
+    for result in results:
+        stage = baseline["stages"].get(result.stage)
+        if stage is None:
+            continue
+        median = statistics.median(stage["times"])
+        spread = (noise(stage["times"]) ** 2 + noise(result.times) ** 2) ** 0.5
+        comparisons.append(
+            Comparison(
+                result.stage,
+                median,
+                result.median,
+                median * (1 + threshold) + deviations * spread,
+            )
+        )
+    return comparisons
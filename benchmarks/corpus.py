@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import random
+import shutil
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+words = (
+    "trove qubesly shadow tower radiant cornerstone club adventure biome"
+    " dragon gem ally mount wings costume style recipe loot collection"
+    " $prefab_item_name $ui_menu_title 0 1 2 3 4 5 6 7 8 9 < > = / { }"
+).split()
+extensions = {
+    "audio": "bank",
+    "blueprints": "blueprint",
+    "languages": "binfab",
+    "textures": "dds",
+    "ui": "swf",
+}
+
+
+class CorpusSpec(NamedTuple):
+    directories: tuple[str, ...] = (
+        "languages/en",
+        "blueprints/items",
+        "blueprints/placeables",
+        "ui/menus",
+        "textures/items",
+        "audio/sfx",
+    )
+    archives: int = 2
+    files: int = 250
+    median_size: int = 4096
+    sigma: float = 1.5
+    max_size: int = 4 * 1024**2
+    text_ratio: float = 0.75
+    seed: int = 0
+
+    @property
+    def total_files(self) -> int:
+        return len(self.directories) * self.archives * self.files
+
+
+def write_varint(value: int) -> bytes:
+    data = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def payload(rnd: random.Random, spec: CorpusSpec) -> bytes:
+    size = min(int(rnd.lognormvariate(0, spec.sigma) * spec.median_size), spec.max_size)
+    if rnd.random() >= spec.text_ratio:
+        return rnd.randbytes(size)
+    text = " ".join(rnd.choices(words, k=size // 4 + 1)).encode()
+    return text[:size]
+
+
+def generate(
+    root: Path,
+    spec: CorpusSpec = CorpusSpec(),
+    change_ratio: float = 0.0,
+    added_ratio: float = 0.0,
+    removed_ratio: float = 0.0,
+    patch_seed: int = 1,
+) -> Path:
+    """Writes an install of index.tfi and archiveN.tfa files under root.
+
+    The same spec always produces the same install. Non-zero ratios produce a
+    patched version of it instead, where that share of files changed, was added
+    or was removed according to patch_seed."""
+    rnd = random.Random(spec.seed)
+    patch = random.Random(patch_seed)
+    for directory in spec.directories:
+        path = root.joinpath(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        extension = extensions.get(directory.split("/", 1)[0], "bin")
+        index = bytearray()
+        for archive in range(spec.archives):
+            files = []
+            for i in range(spec.files):
+                name = f"{path.name}_{archive}_{i}.{extension}"
+                data = payload(rnd, spec)
+                if patch.random() < removed_ratio:
+                    continue
+                if patch.random() < change_ratio:
+                    data = payload(patch, spec)
+                files.append((name, data))
+                if patch.random() < added_ratio:
+                    files.append((f"added_{name}", payload(patch, spec)))
+            content = bytearray()
+            for name, data in files:
+                encoded = name.encode()
+                index += write_varint(len(encoded)) + encoded
+                index += write_varint(archive) + write_varint(len(content))
+                index += write_varint(len(data)) + write_varint(zlib.crc32(data))
+                content += data
+            path.joinpath(f"archive{archive}.tfa").write_bytes(zlib.compress(content))
+        path.joinpath("index.tfi").write_bytes(index)
+    return root
+
+
+def ensure(root: Path, spec: CorpusSpec = CorpusSpec(), **patch) -> Path:
+    """Generates the install unless root already holds the same one."""
+    description = json.dumps({"spec": spec._asdict(), "patch": patch}, sort_keys=True)
+    marker = root.joinpath("corpus.json")
+    if marker.exists():
+        if marker.read_text() == description:
+            return root
+        shutil.rmtree(root)
+    generate(root, spec, **patch)
+    marker.write_text(description)
+    return root
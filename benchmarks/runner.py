@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import shutil
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from benchmarks.corpus import CorpusSpec, ensure
+from utils.extractor import TFIndex, find_changes, known_directories
+from utils.walker import DirectoryWalker
+
+
+class StageResult(NamedTuple):
+    stage: str
+    files: int
+    bytes: int
+    times: list[float]
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.times)
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.median if self.median else 0.0
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / 1024**2 / self.median if self.median else 0.0
+
+
+class Benchmark:
+    """Times the extraction engine stages against a synthetic install.
+
+    The base install is parsed, inflated and extracted, the patched install is
+    compared against the extraction of the base one. Installs are generated once
+    in the work directory and reused as long as the spec does not change."""
+
+    stages = ("parse", "inflate", "find_changes", "extract")
+
+    def __init__(
+        self,
+        workdir: Path,
+        spec: CorpusSpec = CorpusSpec(),
+        change_ratio: float = 0.1,
+        repeat: int = 5,
+    ):
+        self.workdir = workdir
+        self.spec = spec
+        self.change_ratio = change_ratio
+        self.repeat = repeat
+        self.base = workdir.joinpath("base")
+        self.patch = workdir.joinpath("patch")
+        self.extracted = workdir.joinpath("extracted")
+        self.output = workdir.joinpath("output")
+        self.totals: dict[Path, tuple[int, int]] = {}
+
+    async def index_paths(self, root: Path) -> list[Path]:
+        return await DirectoryWalker("index.tfi").find(root, known_directories)
+
+    async def indexes(self, root: Path) -> list[TFIndex]:
+        return [TFIndex(path, root) for path in await self.index_paths(root)]
+
+    async def prepare(self):
+        ensure(self.base, self.spec)
+        ensure(
+            self.patch,
+            self.spec,
+            change_ratio=self.change_ratio,
+            added_ratio=self.change_ratio / 4,
+            removed_ratio=self.change_ratio / 4,
+        )
+        for root in (self.base, self.patch):
+            entries = [e for i in await self.indexes(root) for e in await i.files_list]
+            self.totals[root] = (len(entries), sum(e.size for e in entries))
+        marker = self.extracted.joinpath("corpus.json")
+        description = self.base.joinpath("corpus.json").read_text()
+        if not marker.exists() or marker.read_text() != description:
+            shutil.rmtree(self.extracted, ignore_errors=True)
+            await self.extract_to(self.extracted)
+            marker.write_text(description)
+
+    async def extract_to(self, path: Path):
+        for index in await self.indexes(self.base):
+            for archive in index.archives:
+                async for file in archive.files():
+                    await file.save(path)
+                    file.release()
+                archive.release()
+
+    async def parse(self) -> tuple[int, int]:
+        paths = await self.index_paths(self.base)
+        files = 0
+        for path in paths:
+            files += len(await TFIndex(path, self.base).files_list)
+        return files, sum(path.stat().st_size for path in paths)
+
+    async def inflate(self) -> tuple[int, int]:
+        for index in await self.indexes(self.base):
+            for archive in index.archives:
+                await archive.content
+                archive.release()
+        return self.totals[self.base]
+
+    async def find_changes(self) -> tuple[int, int]:
+        async for file in find_changes(self.patch, self.extracted, {}):
+            file.release()
+        return self.totals[self.patch]
+
+    async def extract(self) -> tuple[int, int]:
+        await self.extract_to(self.output)
+        return self.totals[self.base]
+
+    def clean_extract(self):
+        shutil.rmtree(self.output, ignore_errors=True)
+
+    async def measure(
+        self,
+        stage: str,
+        run: Callable[[], Awaitable[tuple[int, int]]],
+        setup: Optional[Callable[[], None]] = None,
+    ) -> StageResult:
+        times = []
+        # The first run only warms up the page cache and is not timed
+        for i in range(self.repeat + 1):
+            if setup is not None:
+                setup()
+            gc.collect()
+            start = perf_counter()
+            files, size = await run()
+            if i:
+                times.append(perf_counter() - start)
+        return StageResult(stage, files, size, times)
+
+    async def run(self, stages: Optional[list[str]] = None) -> list[StageResult]:
+        await self.prepare()
+        results = []
+        for stage in stages or self.stages:
+            setup = self.clean_extract if stage == "extract" else None
+            results.append(await self.measure(stage, getattr(self, stage), setup))
+        self.clean_extract()
+        return results
+
+
+def print_results(results: list[StageResult]):
+    print(
+        f"{'Stage':<14}{'Files':>9}{'MB':>10}{'Median s':>11}"
+        f"{'Files/s':>12}{'MB/s':>10}"
+    )
+    for result in results:
+        print(
+            f"{result.stage:<14}{result.files:>9}{result.bytes / 1024**2:>10.2f}"
+            f"{result.median:>11.4f}{result.files_per_second:>12.0f}"
+            f"{result.mb_per_second:>10.2f}"
+        )
+
+
+def parse_args(args=None):
+    defaults = CorpusSpec()
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.runner",
+        description="Benchmarks the extraction engine against a synthetic install",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        default=Path(tempfile.gettempdir()).joinpath("trove-benchmarks"),
+        help="Where the synthetic installs are generated and kept",
+    )
+    parser.add_argument(
+        "--stage",
+        action="append",
+        choices=Benchmark.stages,
+        help="Stage to run, can be repeated, defaults to all of them",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Measured runs per stage, at least 1"
+    )
+    parser.add_argument("--archives", type=int, default=defaults.archives)
+    parser.add_argument(
+        "--files", type=int, default=defaults.files, help="Files per archive"
+    )
+    parser.add_argument("--median-size", type=int, default=defaults.median_size)
+    parser.add_argument("--sigma", type=float, default=defaults.sigma)
+    parser.add_argument("--text-ratio", type=float, default=defaults.text_ratio)
+    parser.add_argument("--change-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--save", type=Path, help="Save the results as a baseline")
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="Compare against a baseline and fail when a stage regresses",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Slowdown of the median allowed before a stage fails",
+    )
+    parser.add_argument(
+        "--deviations",
+        type=float,
+        default=3.0,
+        help="Deviations of the timings added on top of the threshold",
+    )
+    args = parser.parse_args(args)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    return args
+
+
+def spec_from_args(args) -> CorpusSpec:
+    return CorpusSpec(
+        archives=args.archives,
+        files=args.files,
+        median_size=args.median_size,
+        sigma=args.sigma,
+        text_ratio=args.text_ratio,
+        seed=args.seed,
+    )
+
+
+def print_comparisons(comparisons) -> bool:
+    print(
+        f"{'Stage':<14}{'Baseline s':>12}{'Median s':>11}{'Change':>9}{'Limit s':>10}"
+    )
+    for comparison in comparisons:
+        print(
+            f"{comparison.stage:<14}{comparison.baseline:>12.4f}"
+            f"{comparison.median:>11.4f}{comparison.change:>+9.1%}"
+            f"{comparison.limit:>10.4f}"
+            + ("  REGRESSED" if comparison.regressed else "")
+        )
+    return any(comparison.regressed for comparison in comparisons)
+
+
+def main():
+    from benchmarks.baseline import compare, load_baseline, save_baseline
+
+    args = parse_args()
+    spec = spec_from_args(args)
+    benchmark = Benchmark(args.workdir, spec, args.change_ratio, args.repeat)
+    results = asyncio.run(benchmark.run(args.stage))
+    print_results(results)
+    if args.save is not None:
+        save_baseline(args.save, results, spec, args.change_ratio)
+    if args.baseline is not None:
+        try:
+            comparisons = compare(
+                load_baseline(args.baseline),
+                results,
+                spec,
+                args.change_ratio,
+                args.threshold,
+                args.deviations,
+            )
+        except ValueError as e:
+            print(e)
+            sys.exit(2)
+        print()
+        if print_comparisons(comparisons):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
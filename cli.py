@@ -0,0 +1,460 @@
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+from humanize import naturalsize
+from yaml import dump
+
+from utils.batch import BatchExtractor, BatchInstall, BatchMode
+from utils.cache import InflateCache
+from utils.diff import diff_installs, export_entry
+from utils.extractor import FileStatus, find_all_indexes
+from utils.grep import ContentGrep
+from utils.history import PatchHistory, index_entries
+from utils.memory import BudgetAction, MemoryBudgetExceeded, memory
+from utils.planner import ExtractionPlan
+from utils.search import CatalogSearch
+from utils.tracing import tracer
+from utils.trigrams import TrigramIndex
+
+
+def trove_locations() -> list[Path]:
+    from utils.trove import GetTroveLocations
+
+    return [location[1] for location in GetTroveLocations()]
+
+
+def parse_install(value: str) -> BatchInstall:
+    root, _, extract_to = value.partition("=")
+    return BatchInstall(Path(root), Path(extract_to) if extract_to else None)
+
+
+def get_cache(args):
+    if args.cache is None:
+        return None
+    return InflateCache(args.cache, args.cache_size)
+
+
+async def batch(args):
+    installs = args.install or [BatchInstall(path) for path in trove_locations()]
+    if not installs:
+        print("No Trove installs were found.")
+        return
+    extractor = BatchExtractor(
+        installs,
+        mode=BatchMode[args.mode],
+        archives_limit=args.archives,
+        io_limit=args.io,
+        cache=get_cache(args),
+        use_hashes=args.use_hashes,
+    )
+    start = perf_counter()
+    await extractor.run()
+    print(
+        f"Processed {extractor.archives_total} archives, "
+        f"{extractor.archives_shared} shared between installs, "
+        f"{extractor.archives_skipped} skipped by hash "
+        f"in {round(perf_counter() - start, 2)}s"
+    )
+    for install in installs:
+        print(
+            f"{install.root}: {len(install.changes)} changed, "
+            f"{install.files_written} written "
+            f"[{naturalsize(install.bytes_written, gnu=True)}] to {install.extract_to}"
+        )
+    print_memory()
+
+
+def print_memory():
+    report = memory.report()
+    print(
+        f"Peak RSS {naturalsize(report['Peak RSS'], gnu=True)}, "
+        f"peak buffers {naturalsize(report['Peak buffers'], gnu=True)} ("
+        + ", ".join(
+            f"{kind.lower()} {naturalsize(buffers['Peak'], gnu=True)}"
+            for kind, buffers in report["Buffers"].items()
+        )
+        + ")"
+    )
+
+
+async def diff(args):
+    start = perf_counter()
+    report = {
+        status.value: [] for status in FileStatus if status != FileStatus.unchanged
+    }
+    size = 0
+    async for entry in diff_installs(args.old, args.new, get_cache(args)):
+        print(f"{entry.status.value:<8} {entry.relative_path}")
+        report[entry.status.value].append(entry.relative_path)
+        size += entry.size
+        if args.export is not None:
+            await export_entry(entry, args.export)
+    print(
+        ", ".join(f"{len(paths)} {status.lower()}" for status, paths in report.items())
+        + f" [{naturalsize(size, gnu=True)}] in {round(perf_counter() - start, 2)}s"
+    )
+    if args.export is not None:
+        args.export.mkdir(parents=True, exist_ok=True)
+        metadata = {
+            "Old": str(args.old),
+            "New": str(args.new),
+            "Date": datetime.now().isoformat(),
+            "Files": report,
+        }
+        with open(args.export.joinpath("metadata.yml"), "w+") as f:
+            dump(metadata, f, sort_keys=False)
+
+
+async def get_catalog(args) -> CatalogSearch:
+    return await CatalogSearch.build(
+        [
+            index
+            async for index in find_all_indexes(
+                args.root, {}, False, cache=get_cache(args)
+            )
+        ]
+    )
+
+
+async def extract(args):
+    start = perf_counter()
+    catalog = await get_catalog(args)
+    if args.regex:
+        result = catalog.regex(args.query)
+    elif args.prefix:
+        result = catalog.prefix(args.query)
+    else:
+        result = catalog.glob(args.query)
+    print(
+        f"{len(result)} of {len(catalog)} files matched "
+        f"[{naturalsize(result.size, gnu=True)}]"
+    )
+    if args.list:
+        for path in result:
+            print(path)
+        return
+    extract_to = args.output or args.root.joinpath("extracted")
+    plan = ExtractionPlan(result.files())
+    for archive_plan in plan:
+        await archive_plan.archive.content_until(archive_plan.end)
+        for file in archive_plan.writes:
+            await file.save(extract_to)
+            file.release()
+        archive_plan.archive.release()
+    print(
+        f"Extracted {len(plan)} files to {extract_to} "
+        f"in {round(perf_counter() - start, 2)}s"
+    )
+    print_memory()
+
+
+async def grep(args):
+    start = perf_counter()
+    catalog = await get_catalog(args)
+    result = catalog.glob(args.query)
+    searcher = ContentGrep(
+        args.pattern.encode(),
+        regex=args.regex,
+        ignore_case=args.ignore_case,
+        workers=args.workers,
+        memory_budget=args.memory,
+    )
+    matches = 0
+    files = set()
+    async for match in searcher.search(result.files()):
+        print(f"{match.path}:{match.offset}")
+        matches += 1
+        files.add(match.path)
+    print(
+        f"{matches} matches in {len(files)} of {len(result)} files "
+        f"[{naturalsize(result.size, gnu=True)} scanned] "
+        f"in {round(perf_counter() - start, 2)}s"
+    )
+
+
+def get_trigrams(args) -> TrigramIndex:
+    return TrigramIndex(args.db or args.root.joinpath("extracted", "trigrams.db"))
+
+
+async def index(args):
+    start = perf_counter()
+    catalog = await get_catalog(args)
+    trigram_index = get_trigrams(args)
+    try:
+        indexed, removed = await trigram_index.update(catalog)
+        print(
+            f"Indexed {indexed} files, removed {removed}, "
+            f"{len(trigram_index)} files in the index "
+            f"in {round(perf_counter() - start, 2)}s"
+        )
+    finally:
+        trigram_index.close()
+
+
+async def find(args):
+    start = perf_counter()
+    trigram_index = get_trigrams(args)
+    try:
+        paths = trigram_index.candidates(args.text)
+    except ValueError as e:
+        print(e)
+        return
+    finally:
+        trigram_index.close()
+    if not args.verify:
+        for path in paths:
+            print(path)
+        print(f"{len(paths)} files in {round((perf_counter() - start) * 1000, 2)}ms")
+        return
+    catalog = await get_catalog(args)
+    rows = [catalog.find(path) for path in paths]
+    files = [catalog.file(row) for row in rows if row is not None]
+    searcher = ContentGrep(args.text.encode(), ignore_case=True)
+    matches = 0
+    async for match in searcher.search(files):
+        print(f"{match.path}:{match.offset}")
+        matches += 1
+    print(
+        f"{matches} matches in {len(paths)} candidate files "
+        f"in {round(perf_counter() - start, 2)}s"
+    )
+
+
+def get_history(args) -> PatchHistory:
+    if args.db is not None:
+        return PatchHistory(args.db)
+    app_data = Path(os.environ.get("APPDATA", Path.home()))
+    return PatchHistory(
+        app_data.joinpath("Trove/sly.dev/TroveFileExtractor", "history.db")
+    )
+
+
+async def history(args):
+    patch_history = get_history(args)
+    source = str(args.root)
+    try:
+        if args.record:
+            indexes = [index async for index in find_all_indexes(args.root, {}, False)]
+            entries, fingerprint = await index_entries(indexes)
+            snapshot = patch_history.record(source, entries, fingerprint)
+            print(
+                f"Recorded snapshot {snapshot.id}"
+                if snapshot is not None
+                else "No index changed since the last snapshot."
+            )
+        elif args.changes is not None:
+            old, new = args.changes
+            changes = patch_history.changes(old, new)
+            for entry in changes:
+                print(f"{entry.status.value:<8} {entry.path}")
+            print(f"{len(changes)} files differ between snapshots {old} and {new}")
+        elif args.last_changed is not None:
+            snapshot = patch_history.last_changed(source, args.last_changed)
+            if snapshot is None:
+                print(f"{args.last_changed} is not in the history.")
+            else:
+                print(f"{snapshot.id} {snapshot.created.isoformat(' ', 'seconds')}")
+        else:
+            snapshots = patch_history.snapshots(source)
+            for snapshot in snapshots:
+                print(f"{snapshot.id} {snapshot.created.isoformat(' ', 'seconds')}")
+            print(f"{len(snapshots)} snapshots of {source}")
+    except ValueError as e:
+        print(e)
+    finally:
+        patch_history.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="TroveFileExtractor",
+        description="A tool for extraction of Trove Archive files",
+    )
+    parser.add_argument(
+        "--cache", type=Path, help="Directory of the inflated archives cache"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=4 * 1024**3,
+        help="Maximum size of the inflated archives cache in bytes",
+    )
+    parser.add_argument(
+        "--trace", type=Path, help="Save a Chrome trace of the run to this file"
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="Maximum bytes held in archive, file and index buffers",
+    )
+    parser.add_argument(
+        "--memory-action",
+        choices=[action.name for action in BudgetAction],
+        default=BudgetAction.abort.name,
+        help="Abort the run or wait for buffers to be released when over budget",
+    )
+    parser.add_argument(
+        "--memory-timeout",
+        type=float,
+        help="Abort a throttled run after waiting this many seconds for buffers",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = commands.add_parser(
+        "batch", help="Extract or diff several installs in one pass"
+    )
+    batch_parser.add_argument(
+        "install",
+        nargs="*",
+        type=parse_install,
+        help="Install as ROOT or ROOT=EXTRACT_TO, defaults to every detected install",
+    )
+    batch_parser.add_argument(
+        "--mode", choices=[mode.name for mode in BatchMode], default="changes"
+    )
+    batch_parser.add_argument(
+        "--archives", type=int, help="Archives processed at the same time"
+    )
+    batch_parser.add_argument(
+        "--io", type=int, default=16, help="File operations at the same time"
+    )
+    batch_parser.add_argument(
+        "--use-hashes",
+        action="store_true",
+        help="Skip archives matching the hashes of the last extraction",
+    )
+    batch_parser.set_defaults(handler=batch)
+
+    diff_parser = commands.add_parser(
+        "diff", help="Compare two installs without extracting them"
+    )
+    diff_parser.add_argument("old", type=Path, help="Install to compare from")
+    diff_parser.add_argument("new", type=Path, help="Install to compare to")
+    diff_parser.add_argument(
+        "--export", type=Path, help="Save old and new payloads of the differences"
+    )
+    diff_parser.set_defaults(handler=diff)
+
+    extract_parser = commands.add_parser(
+        "extract", help="Extract the files matching a query over the catalog"
+    )
+    extract_parser.add_argument("root", type=Path, help="Install to extract from")
+    extract_parser.add_argument(
+        "query", help="Glob over relative paths, e.g. '**/*.blueprint'"
+    )
+    query_type = extract_parser.add_mutually_exclusive_group()
+    query_type.add_argument(
+        "--prefix", action="store_true", help="Match paths starting with the query"
+    )
+    query_type.add_argument(
+        "--regex", action="store_true", help="Match paths against a regex"
+    )
+    extract_parser.add_argument(
+        "--output",
+        type=Path,
+        help="Directory to extract to, defaults to ROOT/extracted",
+    )
+    extract_parser.add_argument(
+        "--list", action="store_true", help="Only list the matching files"
+    )
+    extract_parser.set_defaults(handler=extract)
+
+    grep_parser = commands.add_parser(
+        "grep", help="Search file contents without extracting them"
+    )
+    grep_parser.add_argument("root", type=Path, help="Install to search in")
+    grep_parser.add_argument("pattern", help="Text to search for")
+    grep_parser.add_argument(
+        "--query", default="**", help="Only search files matching this glob"
+    )
+    grep_parser.add_argument(
+        "--regex", action="store_true", help="Search for a regex instead of text"
+    )
+    grep_parser.add_argument(
+        "-i", "--ignore-case", action="store_true", help="Ignore case when matching"
+    )
+    grep_parser.add_argument(
+        "--workers", type=int, help="Processes scanning archives, defaults to cores"
+    )
+    grep_parser.add_argument(
+        "--memory",
+        type=int,
+        default=1024**3,
+        help="Inflated bytes held by the workers at the same time",
+    )
+    grep_parser.set_defaults(handler=grep)
+
+    index_parser = commands.add_parser(
+        "index", help="Build or update the trigram index of text-like files"
+    )
+    index_parser.add_argument("root", type=Path, help="Install to index")
+    index_parser.add_argument(
+        "--db", type=Path, help="Index location, defaults to ROOT/extracted"
+    )
+    index_parser.set_defaults(handler=index)
+
+    find_parser = commands.add_parser(
+        "find", help="Find text-like files containing some text using the index"
+    )
+    find_parser.add_argument("root", type=Path, help="Install the index belongs to")
+    find_parser.add_argument("text", help="Text to look for, at least 3 characters")
+    find_parser.add_argument(
+        "--db", type=Path, help="Index location, defaults to ROOT/extracted"
+    )
+    find_parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Confirm matches against the payloads and print their offsets",
+    )
+    find_parser.set_defaults(handler=find)
+
+    history_parser = commands.add_parser(
+        "history", help="List or compare the recorded snapshots of an install"
+    )
+    history_parser.add_argument("root", type=Path, help="Install the snapshots are of")
+    history_parser.add_argument(
+        "--db", type=Path, help="History location, defaults to the app data"
+    )
+    history_action = history_parser.add_mutually_exclusive_group()
+    history_action.add_argument(
+        "--record",
+        action="store_true",
+        help="Record a snapshot if an index changed since the last one",
+    )
+    history_action.add_argument(
+        "--changes",
+        nargs=2,
+        type=int,
+        metavar=("OLD", "NEW"),
+        help="List the files that differ between two snapshots",
+    )
+    history_action.add_argument(
+        "--last-changed",
+        metavar="PATH",
+        help="Show the latest snapshot in which a file changed",
+    )
+    history_parser.set_defaults(handler=history)
+
+    args = parser.parse_args()
+    if args.trace is not None:
+        tracer.enable()
+    memory.configure(
+        args.memory_budget, BudgetAction[args.memory_action], args.memory_timeout
+    )
+    try:
+        asyncio.run(args.handler(args))
+    except MemoryBudgetExceeded as e:
+        print(f"Aborted, {e}")
+        sys.exit(1)
+    finally:
+        if args.trace is not None:
+            tracer.save(args.trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ import traceback
 from datetime import datetime
 from pathlib import Path
 from time import perf_counter
+from typing import Optional
 
 from flet import (
     ResponsiveRow,
@@ -30,11 +31,24 @@ from humanize import naturalsize
 from yaml import dump
 
 from utils import tasks
-from utils.controls import PathField
-from utils.extractor import find_all_indexes, FileStatus
+from utils.cache import InflateCache
+from utils.controls import FilesList, PathField
+from utils.extractor import find_all_indexes, known_directories, FileStatus
 from utils.functions import throttle, long_throttle
+from utils.history import PatchHistory, index_entries
+from utils.memory import MemoryBudgetExceeded, memory
+from utils.metrics import metrics
+from utils.planner import ExtractionPlan
+from utils.progress import ProgressBus, ProgressFrame
+from utils.search import CatalogSearch, ScanResult
+from utils.tracing import tracer
+from utils.walker import DirectoryWalker
 from utils.trove import GetTroveLocations
 
+# Files processed between yields to the event loop, compares and writes that
+# never wait would otherwise starve the progress watchers
+yield_every = 64
+
 
 class Interface:
     def __init__(self, page):
@@ -42,6 +56,19 @@ class Interface:
         self.tfi_list = []
         self.main = ResponsiveRow(alignment=MainAxisAlignment.START)
         self.cancel_extraction = False
+        self.catalog = CatalogSearch()
+        self.search_result = None
+        self.changed_files = ScanResult(self.catalog)
+        self.scanning = False
+        self.scanned = set()
+        self.directory_rows = {}
+        self.selected_indexes = 0
+        self.selected_bytes = 0
+        self.selected_changes = 0
+        self.selected_changed_bytes = 0
+        self.scan_events = ProgressBus()
+        self.extraction_events = ProgressBus()
+        self.history_task: Optional[asyncio.Task] = None
         self.setup_controls()
 
     def setup_controls(self):
@@ -123,6 +150,16 @@ class Interface:
         self.extract_all_button = ElevatedButton(
             "Extract all", on_click=self.extract_all, disabled=True, col=6
         )
+        self.search_query = TextField(
+            label="Search files (e.g. **/*.blueprint)",
+            dense=True,
+            on_submit=self.search_catalog,
+            disabled=True,
+            col=8,
+        )
+        self.extract_matching_button = ElevatedButton(
+            "Extract matching", on_click=self.extract_matching, disabled=True, col=4
+        )
         self.cancel_extraction_button = ElevatedButton(
             "Cancel extraction",
             on_click=self.cancel_ongoing_extraction,
@@ -151,70 +188,91 @@ class Interface:
             disabled=not self.page.preferences.advanced_mode,
             col=6,
         )
-        self.main_controls = ResponsiveRow(
+        self.scan_controls = ResponsiveRow(
             controls=[
                 ResponsiveRow(
                     controls=[
-                        ResponsiveRow(
-                            controls=[
-                                ResponsiveRow(
-                                    controls=[
-                                        IconButton(
-                                            icons.FOLDER,
-                                            data="extract_from",
-                                            on_click=self.pick_directory,
-                                            col=2,
-                                        ),
-                                        self.extract_from,
-                                    ],
-                                    vertical_alignment="center",
-                                    col=6,
-                                ),
-                                self.directory_dropdown,
-                            ],
-                        ),
                         ResponsiveRow(
                             controls=[
                                 IconButton(
                                     icons.FOLDER,
-                                    data="extract_to",
+                                    data="extract_from",
                                     on_click=self.pick_directory,
-                                    col=1,
+                                    col=2,
                                 ),
-                                self.extract_to,
+                                self.extract_from,
                             ],
                             vertical_alignment="center",
-                            col=12,
-                        ),
-                        ElevatedButton(
-                            "Refresh directory list",
-                            on_click=self.refresh_directories,
                             col=6,
                         ),
-                        self.refresh_with_changes_button,
-                        Row(
-                            controls=[
-                                Switch(
-                                    value=self.page.preferences.advanced_mode,
-                                    on_change=self.switch_advanced_mode,
-                                ),
-                                Text("Advanced Settings"),
-                            ],
-                            col=6,
+                        self.directory_dropdown,
+                    ],
+                ),
+                ResponsiveRow(
+                    controls=[
+                        IconButton(
+                            icons.FOLDER,
+                            data="extract_to",
+                            on_click=self.pick_directory,
+                            col=1,
                         ),
-                        Row(
-                            controls=[
-                                Switch(
-                                    value=self.page.preferences.performance_mode,
-                                    on_change=self.switch_performance_mode,
-                                ),
-                                Text("Performance Mode"),
-                            ],
-                            col=6,
+                        self.extract_to,
+                    ],
+                    vertical_alignment="center",
+                    col=12,
+                ),
+                ElevatedButton(
+                    "Refresh directory list",
+                    on_click=self.refresh_directories,
+                    col=6,
+                ),
+                self.refresh_with_changes_button,
+                Row(
+                    controls=[
+                        Switch(
+                            value=self.page.preferences.advanced_mode,
+                            on_change=self.switch_advanced_mode,
+                        ),
+                        Text("Advanced Settings"),
+                    ],
+                    col=6,
+                ),
+                Row(
+                    controls=[
+                        Switch(
+                            value=self.page.preferences.performance_mode,
+                            on_change=self.switch_performance_mode,
+                        ),
+                        Text("Performance Mode"),
+                    ],
+                    col=6,
+                ),
+                Row(
+                    controls=[
+                        Switch(
+                            value=self.page.preferences.inflate_cache,
+                            on_change=self.switch_inflate_cache,
+                        ),
+                        Text("Inflate Cache"),
+                    ],
+                    col=6,
+                ),
+                Row(
+                    controls=[
+                        Switch(
+                            value=self.page.preferences.trace,
+                            on_change=self.switch_trace,
                         ),
+                        Text("Trace Runs"),
                     ],
                     col=6,
                 ),
+            ],
+            col=6,
+        )
+        self.main_controls = ResponsiveRow(
+            controls=[
+                self.scan_controls,
                 ResponsiveRow(
                     controls=[
                         ResponsiveRow(
@@ -235,6 +293,13 @@ class Interface:
                         self.extract_changes_button,
                         self.extract_selected_button,
                         self.extract_all_button,
+                        ResponsiveRow(
+                            controls=[
+                                self.search_query,
+                                self.extract_matching_button,
+                            ],
+                            vertical_alignment="center",
+                        ),
                     ],
                     col=6,
                 ),
@@ -261,16 +326,13 @@ class Interface:
             sort_column_index=2,
             visible=False,
         )
-        self.files_list = DataTable(
-            columns=[DataColumn(Text("Path")), DataColumn(Text("Size"))],
-            column_spacing=15,
-            heading_row_height=35,
-            data_row_height=25,
-            visible=False,
-        )
+        self.files_list = FilesList(visible=False)
         self.metrics = Column(
             controls=[
-                Row(controls=[Text("Update Size:"), Text(naturalsize(0, gnu=True))])
+                Row(controls=[Text("Update Size:"), Text(naturalsize(0, gnu=True))]),
+                Row(controls=[Text("Scan stages:"), Text("")], wrap=True),
+                Row(controls=[Text("Extraction stages:"), Text("")], wrap=True),
+                Row(controls=[Text("Memory:"), Text("")], wrap=True),
             ]
         )
         self.extraction_progress = Column(
@@ -293,7 +355,7 @@ class Interface:
         )
         self.main.controls = [
             Column(controls=[self.main_controls]),
-            Column(controls=[self.extraction_progress]),
+            Column(controls=[self.extraction_progress, self.metrics]),
             Column(
                 controls=[
                     Row(
@@ -313,7 +375,7 @@ class Interface:
             Column(
                 controls=[
                     Text("Changed/Added Files List", size=20),
-                    Column(controls=[self.files_list], height=475, scroll="auto"),
+                    self.files_list,
                 ],
                 height=475,
                 col=6,
@@ -336,35 +398,21 @@ class Interface:
     async def select_all(self, _):
         for row in self.directory_list.rows:
             row.selected = True
-        self.extract_selected_button.disabled = False
-        selected_size = sum(
-            [
-                f["size"]
-                for r in self.directory_list.rows
-                for f in await r.data.files_list
-                if r.selected
-            ]
-        )
-        self.extract_selected_button.text = (
-            f"Extract Selected [{naturalsize(selected_size, gnu=True)}]"
+        self.count_selection()
+        self.files_list.show_indexes(
+            index.relative_path for index in self.ready_selection()
         )
+        self.show_totals()
         await self.page.update_async()
 
     async def unselect_all(self, _):
         for row in self.directory_list.rows:
             row.selected = False
-        self.extract_selected_button.disabled = True
-        selected_size = sum(
-            [
-                f["size"]
-                for r in self.directory_list.rows
-                for f in await r.data.files_list
-                if r.selected
-            ]
-        )
-        self.extract_selected_button.text = (
-            f"Extract Selected [{naturalsize(selected_size, gnu=True)}]"
+        self.count_selection()
+        self.files_list.show_indexes(
+            index.relative_path for index in self.ready_selection()
         )
+        self.show_totals()
         await self.page.update_async()
 
     @throttle
@@ -407,7 +455,7 @@ class Interface:
         await self.page.update_async()
         await asyncio.sleep(0.5)
         self.directory_list.rows.sort(
-            key=lambda x: int(x.cells[event.column_index].content.value),
+            key=lambda x: x.cells[event.column_index].data,
             reverse=not event.ascending,
         )
         self.directory_list.sort_ascending = event.ascending
@@ -429,19 +477,6 @@ class Interface:
         if event.path is None:
             return
         if event.control.data == "extract_from":
-            known_directories = [
-                "audio",
-                "blueprints",
-                "fonts",
-                "languages",
-                "models",
-                "movies",
-                "particles",
-                "prefabs",
-                "shadersunified",
-                "textures",
-                "ui",
-            ]
             for directory in known_directories:
                 if not Path(event.path).joinpath(directory).exists():
                     self.page.snack_bar.content.value = (
@@ -458,7 +493,7 @@ class Interface:
             )
         if event.control.data in ["extract_from", "changes_from"]:
             self.directory_list.rows.clear()
-            self.files_list.rows.clear()
+            self.files_list.load(None)
         setattr(self.locations, event.control.data, Path(event.path))
         control = getattr(self, event.control.data)
         setattr(control, "value", Path(event.path))
@@ -504,42 +539,42 @@ class Interface:
         self.page.preferences.performance_mode = event.control.value
         self.page.preferences.save()
 
+    async def switch_inflate_cache(self, event):
+        self.page.preferences.inflate_cache = event.control.value
+        self.page.preferences.save()
+
+    async def switch_trace(self, event):
+        self.page.preferences.trace = event.control.value
+        self.page.preferences.save()
+
+    def start_trace(self):
+        # Every run saves its own trace, so events never pile up across runs
+        tracer.reset()
+        if self.page.preferences.trace:
+            tracer.enable()
+        else:
+            tracer.disable()
+
+    def save_trace(self):
+        if tracer.enabled:
+            tracer.save(self.locations.extract_to.joinpath("trace.json"))
+
+    @property
+    def inflate_cache(self):
+        if not self.page.preferences.inflate_cache:
+            return None
+        return InflateCache(
+            self.page.preferences.path.parent.joinpath("cache"),
+            self.page.preferences.inflate_cache_size,
+        )
+
     async def directory_selection(self, event):
         event.control.selected = not event.control.selected
-        for row in self.files_list.rows:
-            if row.data is not None:
-                if row.data.archive.index == event.control.data:
-                    row.visible = event.control.selected
+        if self.is_ready(event.control.data):
+            self.add_selection(event.control.data, 1 if event.control.selected else -1)
         selected_indexes = [r.data for r in self.directory_list.rows if r.selected]
-        changes = [f for f in self.changed_files if f.archive.index in selected_indexes]
-        changes_size = sum([f.size for f in changes])
-        selected_size = sum(
-            [
-                f["size"]
-                for r in self.directory_list.rows
-                for f in await r.data.files_list
-                if r.selected
-            ]
-        )
-        all_size = sum(
-            [
-                f["size"]
-                for r in self.directory_list.rows
-                for f in await r.data.files_list
-            ]
-        )
-        self.extract_changes_button.text = (
-            f"Extract Changes [{naturalsize(changes_size, gnu=True)}]"
-        )
-        self.extract_selected_button.text = (
-            f"Extract Selected [{naturalsize(selected_size, gnu=True)}]"
-        )
-        self.extract_all_button.text = (
-            f"Extract All [{naturalsize(all_size, gnu=True)}]"
-        )
-        self.extract_selected_button.disabled = not bool(
-            [r for r in self.directory_list.rows if r.selected]
-        )
+        self.files_list.show_indexes(index.relative_path for index in selected_indexes)
+        self.show_totals()
         await self.page.update_async()
 
     async def refresh_directories(self, _):
@@ -554,14 +589,16 @@ class Interface:
     async def refresh_lists(self, with_changes=False):
         try:
             self.directory_list.rows.clear()
-            self.files_list.rows.clear()
-            self.extract_changes_button.disabled = False
-            self.extract_selected_button.disabled = False
+            self.files_list.load(None)
+            self.extract_changes_button.disabled = True
+            self.extract_selected_button.disabled = True
+            self.extract_all_button.disabled = True
             self.directory_progress.visible = True
             self.directory_list.visible = False
             self.files_list.visible = False
             await self.page.update_async()
             await asyncio.sleep(0.5)
+            self.start_run()
             self.hashes = dict()
             if self.page.preferences.performance_mode:
                 hashes_path = self.locations.extract_to.joinpath("hashes.json")
@@ -570,223 +607,278 @@ class Interface:
                         self.hashes = json.loads(hashes_path.read_text())
                     except json.JSONDecodeError:
                         print("Failed to load hashes, malformed file.")
-            self.changed_files = []
             indexes = []
-            i = 0
+            walker = DirectoryWalker(
+                "index.tfi", self.locations.extract_to.joinpath("directories.json")
+            )
             async for index in find_all_indexes(
-                self.locations.extract_from, self.hashes, False
+                self.locations.extract_from,
+                self.hashes,
+                False,
+                walker,
+                self.inflate_cache,
             ):
                 indexes.append([index, len(await index.files_list), 0])
-            if with_changes:
-                total_files = sum([index[1] for index in indexes])
-                progress = 0
-                start = perf_counter()
-                for index, files_count, _ in indexes:
-                    index_hash = self.hashes.get(
-                        str(index.path.relative_to(self.locations.extract_from))
-                    )
-                    if index_hash is None or (await index.content_hash) != index_hash:
-                        for archive in index.archives:
-                            archive_hash = self.hashes.get(
-                                archive.path.relative_to(self.locations.extract_from)
-                            )
-                            if (
-                                archive_hash is None
-                                or (await archive.content_hash) != archive_hash
-                            ):
-                                async for file in archive.files():
-                                    i += 1
-                                    if progress < (
-                                        new_progress := round(i / total_files * 1000)
-                                        / 1000
-                                    ):
-                                        elapsed = perf_counter() - start
-                                        remaining = round(
-                                            elapsed * (total_files / i - 1)
-                                        )
-                                        self.directory_progress.controls[0].controls[
-                                            1
-                                        ].value = f"[{round(i / total_files * 100, 1)}%] | Elapsed: {round(elapsed):>3}s | Estimated {remaining:>3}s remaining\r"
-                                        progress = new_progress
-                                        self.directory_progress.controls[
-                                            1
-                                        ].value = new_progress
-                                        await self.directory_progress.update_async()
-                                    if (
-                                        await file.compare(
-                                            self.locations.extract_from,
-                                            self.locations.changes_from,
-                                        )
-                                    ) in [FileStatus.added, FileStatus.changed]:
-                                        self.changed_files.append(file)
-                            else:
-                                i += len(
-                                    [
-                                        f
-                                        for f in archive.index.files_list()
-                                        if int(f["archive_index"]) == archive.id
-                                    ]
-                                )
-                    else:
-                        i += files_count
-            if self.changed_files:
-                self.changed_files.sort(key=lambda x: [x.archive.index.path, x.path])
-                for file in self.changed_files:
-                    for index in indexes:
-                        if index[0] == file.archive.index:
-                            index[2] += 1
-                            break
-            else:
-                self.extract_changes_button.disabled = True
-                self.extract_selected_button.disabled = True
-            indexes.sort(key=lambda x: [-x[2], str(x[0].directory)])
-            for index, files_count, changes_count in indexes:
-                self.directory_list.rows.append(
-                    DataRow(
-                        data=index,
-                        cells=[
-                            DataCell(
-                                Text(
-                                    str(
-                                        index.directory.relative_to(
-                                            self.locations.extract_from
-                                        )
-                                    ),
-                                    color="green" if changes_count else None,
-                                    size=12,
-                                )
-                            ),
-                            DataCell(
-                                Text(
-                                    naturalsize(
-                                        sum(
-                                            [f["size"] for f in await index.files_list]
-                                        ),
-                                        gnu=True,
-                                    ),
-                                    color="green" if changes_count else None,
-                                    size=12,
-                                ),
-                                data=sum([f["size"] for f in await index.files_list]),
-                            ),
-                            DataCell(
-                                Text(
-                                    changes_count,
-                                    color="green" if changes_count else None,
-                                    size=12,
-                                )
-                            ),
-                        ],
-                        selected=bool(changes_count),
-                        on_select_changed=self.directory_selection,
-                    )
-                )
-            if len(self.changed_files) > 2000:
-                self.files_list.rows.append(
-                    DataRow(
-                        cells=[
-                            DataCell(
-                                Text("Too many changes to be displayed.", color="red")
-                            ),
-                            DataCell(Text("")),
-                        ]
-                    )
-                )
-            elif not with_changes:
-                self.files_list.rows.append(
-                    DataRow(
-                        cells=[
-                            DataCell(Text("No changes were queried.")),
-                            DataCell(Text("")),
-                        ]
-                    )
-                )
-                self.extract_changes_button.disabled = True
-            elif len(self.changed_files) == 0:
-                self.files_list.rows.append(
-                    DataRow(
-                        cells=[
-                            DataCell(Text("No changed files found.")),
-                            DataCell(Text("")),
-                        ]
-                    )
+            self.catalog = await CatalogSearch.build([index[0] for index in indexes])
+            self.search_result = None
+            self.changed_files = ScanResult(self.catalog)
+            self.scanned = set()
+            self.scanning = with_changes
+            self.directory_rows = {}
+            indexes.sort(key=lambda x: str(x[0].directory))
+            for index, _, _ in indexes:
+                row = self.directory_row(
+                    index, self.catalog.index_totals[index.relative_path].bytes
                 )
-                self.extract_changes_button.disabled = True
-            else:
-                for file in self.changed_files:
-                    self.files_list.rows.append(
-                        DataRow(
-                            data=file,
-                            cells=[
-                                DataCell(
-                                    Text(
-                                        file.path.relative_to(
-                                            self.locations.extract_from
-                                        ),
-                                        color=file.color,
-                                        size=12,
-                                    )
-                                ),
-                                DataCell(
-                                    Text(
-                                        naturalsize(file.size, gnu=True),
-                                        color=file.color,
-                                        size=12,
-                                    )
-                                ),
-                            ],
-                        )
-                    )
-                self.extract_changes_button.disabled = False
-            selected_indexes = [r.data for r in self.directory_list.rows if r.selected]
-            changes = [
-                f for f in self.changed_files if f.archive.index in selected_indexes
-            ]
-            changes_size = sum([f.size for f in changes])
-            selected_size = sum(
-                [
-                    f["size"]
-                    for r in self.directory_list.rows
-                    for f in await r.data.files_list
-                    if r.selected
-                ]
-            )
-            all_size = sum(
-                [
-                    f["size"]
-                    for r in self.directory_list.rows
-                    for f in await r.data.files_list
-                ]
-            )
-            self.extract_changes_button.text = (
-                f"Extract Changes [{naturalsize(changes_size, gnu=True)}]"
-            )
-            self.extract_selected_button.text = (
-                f"Extract Selected [{naturalsize(selected_size, gnu=True)}]"
-            )
-            self.extract_all_button.text = (
-                f"Extract All [{naturalsize(all_size, gnu=True)}]"
-            )
-            self.metrics.controls[0].controls[1].value = naturalsize(
-                sum([f.size for f in self.changed_files]), gnu=True
-            )
-            self.directory_progress.controls[0].controls[1].value = ""
-            self.directory_progress.controls[1].value = 0
-            self.extract_selected_button.disabled = not bool(
-                [r for r in self.directory_list.rows if r.selected]
+                if not with_changes:
+                    self.show_changes_count(row, 0)
+                self.directory_rows[index.relative_path] = row
+                self.directory_list.rows.append(row)
+            self.files_list.load(
+                None,
+                "Scanning for changes..."
+                if with_changes
+                else "No changes were queried.",
             )
+            # Ready indexes can be browsed and extracted while the scan goes on
+            self.scan_controls.disabled = with_changes
             self.select_all_button.disabled = False
             self.unselect_all_button.disabled = False
-            self.extract_all_button.disabled = False
-            self.directory_progress.visible = False
+            self.search_query.disabled = False
+            self.extract_matching_button.text = "Extract matching"
+            self.extract_matching_button.disabled = True
             self.directory_list.visible = True
             self.files_list.visible = True
             self.main.disabled = False
+            self.count_selection()
+            self.show_totals()
+            await self.page.update_async()
+            self.history_task = asyncio.create_task(
+                self.record_history([index[0] for index in indexes]), name="history"
+            )
+            if with_changes:
+                self.scan_events.start(
+                    "scan", self.catalog.totals.files, self.catalog.totals.bytes
+                )
+                async with self.scan_events.subscribe(self.show_scan_progress):
+                    await self.scan_changes([index[0] for index in indexes])
+                self.scanning = False
+                self.scan_controls.disabled = False
+                self.directory_list.rows.sort(
+                    key=lambda x: [-x.cells[2].data, str(x.data.directory)]
+                )
+                if not self.changed_files:
+                    self.files_list.load(None, "No changed files found.")
+            self.count_selection()
+            self.show_totals()
+            self.show_stage_metrics(1)
+            self.show_memory()
+            self.save_trace()
+            self.directory_progress.controls[0].controls[1].value = ""
+            self.directory_progress.controls[1].value = 0
+            self.directory_progress.visible = False
+            await self.page.update_async()
+            self.refresh_lists.cancel()
+        except MemoryBudgetExceeded as e:
+            self.scanning = False
+            self.scan_controls.disabled = False
+            self.directory_progress.visible = False
+            self.main.disabled = False
+            self.page.snack_bar.content.value = f"Scan aborted, {e}"
+            self.page.snack_bar.bgcolor = "red"
+            self.page.snack_bar.open = True
             await self.page.update_async()
             self.refresh_lists.cancel()
         except Exception as e:
             print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
 
+    async def scan_changes(self, indexes):
+        for index in indexes:
+            await self.index_scanned(index, await self.scan_index(index))
+
+    async def scan_index(self, index) -> int:
+        changes_count = 0
+        index_hash = self.hashes.get(index.relative_path)
+        if index_hash is not None and (await index.content_hash) == index_hash:
+            totals = self.catalog.index_totals[index.relative_path]
+            self.scan_events.advance(totals.bytes, files=totals.files)
+            return changes_count
+        with tracer.span("index", "scan", index=index.relative_path):
+            for archive in index.archives:
+                archive_hash = self.hashes.get(archive.relative_path)
+                if (
+                    archive_hash is not None
+                    and (await archive.content_hash) == archive_hash
+                ):
+                    totals = (await index.archive_totals).get(archive.id)
+                    if totals is not None:
+                        self.scan_events.advance(totals.bytes, files=totals.files)
+                    continue
+                with tracer.span("archive", "scan", archive=archive.relative_path):
+                    async for file in archive.files():
+                        status = await file.compare(self.locations.changes_from)
+                        if status in [FileStatus.added, FileStatus.changed]:
+                            self.changed_files.add(
+                                self.catalog.find(file.relative_path), status
+                            )
+                            changes_count += 1
+                        self.scan_events.advance(file.size)
+                        if not self.scan_events.files % yield_every:
+                            await asyncio.sleep(0)
+                archive.release()
+        return changes_count
+
+    async def index_scanned(self, index, changes_count: int):
+        self.scanned.add(index.relative_path)
+        row = self.directory_rows[index.relative_path]
+        self.show_changes_count(row, changes_count)
+        # Indexes with changes get selected, a selection made while the index
+        # was pending is kept either way
+        if changes_count:
+            row.selected = True
+        if row.selected:
+            self.add_selection(index, 1)
+        if changes_count:
+            self.changed_files.sort()
+            if self.files_list.result is None:
+                self.files_list.load(self.changed_files)
+            else:
+                if self.files_list.indexes is not None:
+                    self.files_list.indexes.add(index.relative_path)
+                self.files_list.refresh()
+        self.show_totals()
+        with tracer.span("index", "ui", index=index.relative_path):
+            await self.page.update_async()
+
+    def directory_row(self, index, size: int) -> DataRow:
+        """Row of an index whose changes are not known yet."""
+        return DataRow(
+            data=index,
+            cells=[
+                DataCell(Text(index.relative_directory, size=12)),
+                DataCell(Text(naturalsize(size, gnu=True), size=12), data=size),
+                DataCell(Text("...", size=12), data=-1),
+            ],
+            on_select_changed=self.directory_selection,
+        )
+
+    def show_changes_count(self, row: DataRow, changes_count: int):
+        for cell in row.cells:
+            cell.content.color = "green" if changes_count else None
+        row.cells[2].content.value = changes_count
+        row.cells[2].data = changes_count
+
+    def is_ready(self, index) -> bool:
+        return not self.scanning or index.relative_path in self.scanned
+
+    def ready_selection(self) -> list:
+        return [
+            r.data
+            for r in self.directory_list.rows
+            if r.selected and self.is_ready(r.data)
+        ]
+
+    def add_selection(self, index, sign: int):
+        totals = self.catalog.index_totals[index.relative_path]
+        changes = self.changed_files.changed(index)
+        self.selected_indexes += sign
+        self.selected_bytes += sign * totals.bytes
+        self.selected_changes += sign * changes.files
+        self.selected_changed_bytes += sign * changes.bytes
+
+    def count_selection(self):
+        """Counts the totals of the selected ready indexes from scratch, clicks
+        on a single row only add or remove that index afterwards."""
+        self.selected_indexes = 0
+        self.selected_bytes = 0
+        self.selected_changes = 0
+        self.selected_changed_bytes = 0
+        for index in self.ready_selection():
+            self.add_selection(index, 1)
+
+    def show_totals(self):
+        self.extract_changes_button.text = (
+            f"Extract Changes [{naturalsize(self.selected_changed_bytes, gnu=True)}]"
+        )
+        self.extract_selected_button.text = (
+            f"Extract Selected [{naturalsize(self.selected_bytes, gnu=True)}]"
+        )
+        self.extract_all_button.text = (
+            f"Extract All [{naturalsize(self.catalog.totals.bytes, gnu=True)}]"
+        )
+        self.extract_changes_button.disabled = not self.selected_changes
+        self.extract_selected_button.disabled = not self.selected_indexes
+        self.extract_all_button.disabled = self.scanning
+        self.metrics.controls[0].controls[1].value = naturalsize(
+            self.changed_files.size, gnu=True
+        )
+
+    async def show_scan_progress(self, frame: ProgressFrame):
+        self.directory_progress.controls[0].controls[1].value = frame.describe()
+        self.directory_progress.controls[1].value = frame.fraction
+        with tracer.span("progress", "ui"):
+            await self.directory_progress.update_async()
+
+    async def show_extraction_progress(self, frame: ProgressFrame):
+        self.extraction_progress.controls[0].controls[
+            0
+        ].value = f"{frame.describe()} | Extracting {frame.task}:"
+        self.extraction_progress.controls[0].controls[1].value = frame.current
+        self.extraction_progress.controls[1].controls[0].value = frame.fraction
+        with tracer.span("progress", "ui"):
+            await self.extraction_progress.update_async()
+
+    def start_run(self):
+        metrics.reset()
+        memory.reset()
+        memory.configure(
+            self.page.preferences.memory_budget,
+            self.page.preferences.memory_budget_action,
+        )
+        self.start_trace()
+
+    def show_memory(self):
+        report = memory.report()
+        self.metrics.controls[3].controls[1].value = " | ".join(
+            [
+                f"Peak RSS {naturalsize(report['Peak RSS'], gnu=True)}",
+                f"Peak buffers {naturalsize(report['Peak buffers'], gnu=True)}",
+            ]
+            + [
+                f"{kind} {naturalsize(buffers['Peak'], gnu=True)}"
+                for kind, buffers in report["Buffers"].items()
+            ]
+        )
+
+    def show_stage_metrics(self, row: int):
+        self.metrics.controls[row].controls[1].value = " | ".join(
+            f"{name} {round(stage.time, 2)}s"
+            + (f" ({naturalsize(stage.throughput, gnu=True)}/s)" if stage.bytes else "")
+            for name, stage in sorted(
+                metrics.stages.items(), key=lambda item: -item[1].time
+            )
+            if stage.count
+        )
+
+    async def record_history(self, indexes):
+        try:
+            # Snapshots are only written when an index changed since the last one
+            entries, fingerprint = await index_entries(indexes)
+            history = PatchHistory(
+                self.page.preferences.path.parent.joinpath("history.db")
+            )
+            try:
+                await asyncio.to_thread(
+                    history.record,
+                    str(self.locations.extract_from),
+                    entries,
+                    fingerprint,
+                )
+            finally:
+                history.close()
+        except Exception as e:
+            print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
     async def warn_advanced_mode(self):
         task_lines = [
             "Advanced mode allows for people to have old vs new changed files in a separate directory",
@@ -881,12 +973,82 @@ class Interface:
     async def extract_all(self, _):
         await self.warn_extraction("all")
 
+    async def search_catalog(self, _):
+        query = self.search_query.value.strip()
+        self.search_result = self.catalog.glob(query) if query else None
+        if self.search_result is None:
+            self.extract_matching_button.text = "Extract matching"
+        else:
+            self.extract_matching_button.text = (
+                f"Extract {len(self.search_result)} matching "
+                f"[{naturalsize(self.search_result.size, gnu=True)}]"
+            )
+        self.extract_matching_button.disabled = not self.search_result
+        await self.extract_matching_button.update_async()
+
+    async def extract_matching(self, _):
+        await self.warn_extraction("matching")
+
     async def extract(self, event):
         self.page.dialog.open = False
         self.main_controls.disabled = True
         await self.page.update_async()
         await asyncio.sleep(0.5)
-        if event.control.data == "changes":
+        if not self.scanning:
+            self.start_run()
+        # Progress is drawn at a fixed frame rate while the extraction runs
+        watcher = asyncio.create_task(
+            self.extraction_events.watch(self.show_extraction_progress),
+            name="progress",
+        )
+        extracted_indexes = None
+        try:
+            extracted_indexes = await self.extract_files(event.control.data)
+        except MemoryBudgetExceeded as e:
+            self.page.snack_bar.content.value = f"Extraction aborted, {e}"
+            self.page.snack_bar.bgcolor = "red"
+            self.page.snack_bar.open = True
+        except Exception as e:
+            print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        finally:
+            watcher.cancel()
+            self.main_controls.disabled = False
+            self.cancel_extraction_button.visible = False
+            self.extraction_progress.controls[0].controls[0].value = "Extractor Idle"
+            self.extraction_progress.controls[0].controls[1].value = ""
+            self.extraction_progress.controls[1].controls[0].value = 0
+        if extracted_indexes is None:
+            # Cancelled or aborted
+            return await self.page.update_async()
+        hashes_path = self.locations.extract_to.joinpath("hashes.json")
+        hashes_path.write_text(json.dumps(self.hashes, indent=4))
+        self.show_stage_metrics(2)
+        self.show_memory()
+        self.save_trace()
+        self.page.snack_bar.content.value = "Extraction Complete"
+        self.page.snack_bar.bgcolor = "green"
+        self.page.snack_bar.open = True
+        await self.page.update_async()
+        if self.scanning:
+            # Extracted indexes are up to date, the others are still being scanned
+            self.changed_files.discard(extracted_indexes)
+            for index in extracted_indexes:
+                row = self.directory_rows[index.relative_path]
+                self.show_changes_count(row, 0)
+                row.selected = False
+            self.files_list.refresh()
+            self.count_selection()
+            self.show_totals()
+            await self.page.update_async()
+        else:
+            # Refresh changes
+            self.refresh_lists.start()
+
+    async def extract_files(self, extraction_type: str) -> Optional[list]:
+        """Writes the files of an extraction, returning the indexes extracted
+        in full or None when cancelled."""
+        extracted_indexes = []
+        if extraction_type == "changes":
             self.cancel_extraction_button.visible = False
             if self.page.preferences.advanced_mode:
                 dated_folder = self.locations.changes_to.joinpath(
@@ -904,59 +1066,38 @@ class Interface:
                 # This in case they want to re-run the extraction, possible
                 with open(old_changes.joinpath("hashes.json"), "w+") as f:
                     f.write(json.dumps(self.hashes, indent=4))
-            selected_indexes = [r.data for r in self.directory_list.rows if r.selected]
-            changes = [
-                f for f in self.changed_files if f.archive.index in selected_indexes
-            ]
-            selected_archives = [f.archive for f in changes]
-            total = len(changes)
+            selected_indexes = self.ready_selection()
+            extracted_indexes = selected_indexes
+            changes = self.changed_files.select(selected_indexes)
+            plan = ExtractionPlan(changes.files())
+            selected_archives = [archive_plan.archive for archive_plan in plan]
+            self.extraction_events.start(extraction_type, len(plan), plan.size)
             start = perf_counter()
-            for i, file in enumerate(changes, 1):
-                old_pro = self.extraction_progress.controls[1].controls[0].value
-                i += 1
-                if old_pro != (progress := round(i / total * 1000) / 1000):
-                    elapsed = perf_counter() - start
-                    remaining = round(elapsed * (total / i - 1))
-                    self.extraction_progress.controls[0].controls[
-                        0
-                    ].value = f"[{round(i / total * 100, 1)}%] | Elapsed: {round(elapsed):>3}s | Estimated {remaining:>3}s remaining | Extracting {event.control.data}:\r"
-                    self.extraction_progress.controls[0].controls[1].value = file.name
-                    self.extraction_progress.controls[1].controls[0].value = progress
-                    await self.extraction_progress.update_async()
-                if self.page.preferences.advanced_mode:
-                    # Keep an old copy for comparisons
-                    await file.copy_old(
-                        self.locations.extract_from,
-                        self.locations.changes_from,
-                        old_changes,
-                    )
-                    # Add changes
-                    await file.save(self.locations.extract_from, new_changes)
-                # Save into extracted location
-                await file.save(self.locations.extract_from, self.locations.extract_to)
-                index_relative_path = file.archive.index.path.relative_to(
-                    self.locations.extract_from
-                )
-                archive_relative_path = file.archive.path.relative_to(
-                    self.locations.extract_from
-                )
-                self.hashes[
-                    str(index_relative_path)
-                ] = await file.archive.index.content_hash
+            for archive_plan in plan:
+                archive = archive_plan.archive
+                await archive.content_until(archive_plan.end)
+                with tracer.span("writes", "write", files=len(archive_plan)):
+                    for file in archive_plan.writes:
+                        if self.page.preferences.advanced_mode:
+                            # Keep an old copy for comparisons
+                            await file.copy_old(
+                                self.locations.changes_from, old_changes
+                            )
+                            # Add changes
+                            await file.save(new_changes)
+                        # Save into extracted location
+                        await file.save(self.locations.extract_to)
+                        self.extraction_events.advance(file.size, file.name)
+                        file.release()
+                        if not self.extraction_events.files % yield_every:
+                            await asyncio.sleep(0)
                 self.hashes[
-                    str(archive_relative_path)
-                ] = await file.archive.content_hash
-            wrote = sum([f.size for f in changes])
-            saved = (
-                sum(
-                    [
-                        f["size"]
-                        for r in self.directory_list.rows
-                        for f in await r.data.files_list
-                    ]
-                )
-                - wrote
-            )
+                    archive.index.relative_path
+                ] = await archive.index.content_hash
+                self.hashes[archive.relative_path] = await archive.content_hash
+                archive.release()
+            wrote = changes.size
+            saved = self.catalog.totals.bytes - wrote
             metadata = {
                 "Extracted From": str(self.locations.extract_from),
                 "Extracted To": str(self.locations.extract_to),
@@ -968,112 +1109,73 @@ class Interface:
                 "Byte writes (Readable)": naturalsize(wrote, gnu=True),
                 "Bytes saved (Readable)": naturalsize(saved, gnu=True),
                 "Time elapsed (Seconds)": round(perf_counter() - start, 2),
+                "Stages": metrics.report(),
+                "Memory": memory.report(),
                 "Extraction": {
                     "Type": "Changes",
                     "Indexes": sorted(
-                        list(
-                            set(
-                                [
-                                    str(
-                                        index.path.relative_to(
-                                            self.locations.extract_from
-                                        )
-                                    )
-                                    for index in selected_indexes
-                                ]
-                            )
-                        )
+                        list(set([index.relative_path for index in selected_indexes]))
                     ),
                     "Archives": (
                         list(
                             set(
-                                [
-                                    str(
-                                        archive.path.relative_to(
-                                            self.locations.extract_from
-                                        )
-                                    )
-                                    for archive in selected_archives
-                                ]
-                            )
-                        )
-                    ),
-                    "Files": (
-                        list(
-                            set(
-                                [
-                                    str(f.path.relative_to(self.locations.extract_from))
-                                    for f in changes
-                                ]
+                                [archive.relative_path for archive in selected_archives]
                             )
                         )
                     ),
+                    "Files": [f.relative_path for f in plan.files],
                 },
             }
             with open(new_changes.joinpath("metadata.yml"), "w+") as f:
                 dump(metadata, f, sort_keys=False)
-        elif event.control.data in ["all", "selected"]:
+        elif extraction_type == "matching":
+            self.cancel_extraction_button.visible = False
+            plan = ExtractionPlan(self.search_result.files())
+            self.extraction_events.start(extraction_type, len(plan), plan.size)
+            for archive_plan in plan:
+                await archive_plan.archive.content_until(archive_plan.end)
+                with tracer.span("writes", "write", files=len(archive_plan)):
+                    for file in archive_plan.writes:
+                        await file.save(self.locations.extract_to)
+                        self.extraction_events.advance(file.size, file.name)
+                        file.release()
+                        if not self.extraction_events.files % yield_every:
+                            await asyncio.sleep(0)
+                archive_plan.archive.release()
+        elif extraction_type in ["all", "selected"]:
             self.cancel_extraction_button.visible = True
             await self.cancel_extraction_button.update_async()
-            if event.control.data == "all":
+            if extraction_type == "all":
                 indexes = [r.data for r in self.directory_list.rows]
-            elif event.control.data == "selected":
-                indexes = [r.data for r in self.directory_list.rows if r.selected]
-            number_of_files = sum([len(await index.files_list) for index in indexes])
-            i = 0
-            start = perf_counter()
+            elif extraction_type == "selected":
+                indexes = self.ready_selection()
+            extracted_indexes = indexes
+            totals = [
+                self.catalog.index_totals[index.relative_path] for index in indexes
+            ]
+            self.extraction_events.start(
+                extraction_type,
+                sum(total.files for total in totals),
+                sum(total.bytes for total in totals),
+            )
             for index in indexes:
-                index_relative_path = index.path.relative_to(
-                    self.locations.extract_from
-                )
-                self.hashes[str(index_relative_path)] = await index.content_hash
+                self.hashes[index.relative_path] = await index.content_hash
                 for archive in index.archives:
-                    archive_relative_path = archive.path.relative_to(
-                        self.locations.extract_from
-                    )
-                    self.hashes[str(archive_relative_path)] = await archive.content_hash
-                    async for file in archive.files():
-                        if self.cancel_extraction:
-                            self.cancel_extraction = False
-                            self.extraction_progress.controls[0].controls[
-                                0
-                            ].value = "Extractor Idle"
-                            self.extraction_progress.controls[0].controls[1].value = ""
-                            self.extraction_progress.controls[1].controls[0].value = 0
-                            self.page.snack_bar.content.value = "Extraction Cancelled"
-                            self.page.snack_bar.bgcolor = "red"
-                            self.page.snack_bar.open = True
-                            return await self.page.update_async()
-                        old_pro = self.extraction_progress.controls[1].controls[0].value
-                        i += 1
-                        if old_pro != (
-                            progress := round(i / number_of_files * 1000) / 1000
-                        ):
-                            elapsed = perf_counter() - start
-                            remaining = round(elapsed * (number_of_files / i - 1))
-                            self.extraction_progress.controls[0].controls[
-                                0
-                            ].value = f"[{round(i / number_of_files * 100, 1)}%] | Elapsed: {round(elapsed):>3}s | Estimated {remaining:>3}s remaining | Extracting {event.control.data}:\r"
-                            self.extraction_progress.controls[0].controls[
-                                1
-                            ].value = file.name
-                            self.extraction_progress.controls[1].controls[
-                                0
-                            ].value = progress
-                            await self.extraction_progress.update_async()
-                        await file.save(
-                            self.locations.extract_from, self.locations.extract_to
-                        )
-        hashes_path = self.locations.extract_to.joinpath("hashes.json")
-        hashes_path.write_text(json.dumps(self.hashes, indent=4))
-        self.main_controls.disabled = False
-        self.cancel_extraction_button.visible = False
-        self.extraction_progress.controls[0].controls[0].value = "Extractor Idle"
-        self.extraction_progress.controls[0].controls[1].value = ""
-        self.extraction_progress.controls[1].controls[0].value = 0
-        self.page.snack_bar.content.value = "Extraction Complete"
-        self.page.snack_bar.bgcolor = "green"
-        self.page.snack_bar.open = True
-        await self.page.update_async()
-        # Refresh changes
-        self.refresh_lists.start()
+                    self.hashes[archive.relative_path] = await archive.content_hash
+                    with tracer.span("archive", "write", archive=archive.relative_path):
+                        async for file in archive.files():
+                            if self.cancel_extraction:
+                                self.cancel_extraction = False
+                                self.page.snack_bar.content.value = (
+                                    "Extraction Cancelled"
+                                )
+                                self.page.snack_bar.bgcolor = "red"
+                                self.page.snack_bar.open = True
+                                return None
+                            await file.save(self.locations.extract_to)
+                            self.extraction_events.advance(file.size, file.name)
+                            file.release()
+                            if not self.extraction_events.files % yield_every:
+                                await asyncio.sleep(0)
+                    archive.release()
+        return extracted_indexes
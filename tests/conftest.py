@@ -0,0 +1,52 @@
+import gc
+import shutil
+import sys
+import zlib
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from benchmarks.corpus import CorpusSpec, generate
+from utils.memory import memory
+
+spec = CorpusSpec(directories=("languages/en", "textures/items"), archives=2, files=40)
+
+
+@pytest.fixture(autouse=True)
+def unbounded_memory():
+    """Leaves the memory governor without a budget and with the buffers of
+    every test released once it is done."""
+    yield memory
+    memory.configure(None)
+    gc.collect()
+
+
+@pytest.fixture
+def install(tmp_path) -> Path:
+    return generate(tmp_path.joinpath("install"), spec)
+
+
+@pytest.fixture
+def patched(tmp_path) -> Path:
+    """A patched version of the install with changed, added and removed files."""
+    return generate(
+        tmp_path.joinpath("patched"),
+        spec,
+        change_ratio=0.2,
+        added_ratio=0.1,
+        removed_ratio=0.1,
+    )
+
+
+@pytest.fixture
+def mutated(install, tmp_path) -> tuple[Path, Path]:
+    """A copy of the install where the first bytes of one archive differ, the
+    index is left as is so every file keeps its offset and size."""
+    root = shutil.copytree(install, tmp_path.joinpath("mutated"))
+    archive = root.joinpath("languages", "en", "archive0.tfa")
+    content = bytearray(zlib.decompress(archive.read_bytes()))
+    content[:64] = bytes(byte ^ 0xFF for byte in content[:64])
+    archive.write_bytes(zlib.compress(content))
+    return root, archive
@@ -0,0 +1,94 @@
+import asyncio
+import os
+
+import pytest
+
+from utils.batch import BatchExtractor, BatchInstall, BatchMode, gather_or_cancel
+from utils.extractor import TFIndex, known_directories
+from utils.memory import BudgetAction, MemoryBudgetExceeded, memory
+from utils.metrics import metrics
+from utils.walker import DirectoryWalker
+
+
+@pytest.fixture
+def installs(install, mutated, tmp_path):
+    root, _ = mutated
+    return [
+        BatchInstall(install, tmp_path.joinpath("out", "install")),
+        BatchInstall(root, tmp_path.joinpath("out", "mutated")),
+    ]
+
+
+async def assert_extracted(install: BatchInstall) -> int:
+    paths = await DirectoryWalker("index.tfi").find(install.root, known_directories)
+    files = 0
+    for path in paths:
+        for archive in TFIndex(path, install.root).archives:
+            async for file in archive.files():
+                extracted = install.extract_to.joinpath(file.relative_path)
+                assert extracted.read_bytes() == await file.content
+                file.release()
+                files += 1
+            archive.release()
+    return files
+
+
+def test_shared_archives_are_inflated_once(installs):
+    extractor = BatchExtractor(installs, BatchMode.all)
+    metrics.reset()
+    asyncio.run(extractor.run())
+    per_install = extractor.archives_total // 2
+    # Every archive but the mutated one is shared between both installs
+    assert extractor.archives_shared == per_install - 1
+    assert metrics.stages["inflate"].count == per_install + 1
+    for install in installs:
+        assert asyncio.run(assert_extracted(install)) == install.files_written
+
+
+def test_changes_only_writes_the_mutated_files(installs):
+    asyncio.run(BatchExtractor(installs[:1], BatchMode.all).run())
+    installs[1].extract_to = installs[0].extract_to
+    extractor = BatchExtractor(installs[1:], BatchMode.changes)
+    asyncio.run(extractor.run())
+    changes = installs[1].changes
+    assert changes
+    assert {file.archive.relative_path for file in changes} == {
+        os.path.join("languages", "en", "archive0.tfa")
+    }
+    assert installs[1].files_written == len(changes)
+    asyncio.run(assert_extracted(installs[1]))
+
+
+def test_throttled_run_completes_under_a_tiny_budget(installs):
+    memory.configure(1024, BudgetAction.throttle)
+    memory.reset()
+    asyncio.run(BatchExtractor(installs, BatchMode.all).run())
+    assert memory.waits
+    assert not memory.live["archive"] and not memory.live["file"]
+    for install in installs:
+        assert asyncio.run(assert_extracted(install)) == install.files_written
+
+
+def test_aborted_run_cancels_the_other_archives(installs):
+    memory.configure(1024, BudgetAction.abort)
+
+    async def run():
+        with pytest.raises(MemoryBudgetExceeded):
+            await BatchExtractor(installs, BatchMode.all).run()
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert not asyncio.run(run())
+
+
+def test_failure_cancels_the_other_awaitables():
+    async def fail():
+        await asyncio.sleep(0)
+        raise MemoryBudgetExceeded("over budget")
+
+    async def run():
+        waiting = asyncio.ensure_future(asyncio.Event().wait())
+        with pytest.raises(MemoryBudgetExceeded):
+            await gather_or_cancel(waiting, fail())
+        return waiting
+
+    assert asyncio.run(run()).cancelled()
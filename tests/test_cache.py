@@ -0,0 +1,31 @@
+import os
+
+from utils.cache import InflateCache
+
+
+def test_get_after_put(tmp_path):
+    cache = InflateCache(tmp_path, 1024)
+    assert cache.get("aa01") is None
+    cache.put("aa01", b"payload")
+    assert cache.get("aa01") == b"payload"
+    assert cache.size == len(b"payload")
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = InflateCache(tmp_path, 300)
+    for time, key in enumerate(["aa01", "bb02", "cc03"]):
+        cache.put(key, bytes(100))
+        os.utime(cache.path(key), (time, time))
+    # Reading an entry makes it the most recently used one
+    assert cache.get("aa01") is not None
+    cache.put("dd04", bytes(100))
+    assert cache.get("bb02") is None
+    assert all(cache.get(key) is not None for key in ["aa01", "cc03", "dd04"])
+    assert cache.size == 300
+
+
+def test_skips_entries_over_the_budget(tmp_path):
+    cache = InflateCache(tmp_path, 100)
+    cache.put("aa01", bytes(101))
+    assert cache.get("aa01") is None
+    assert cache.size == 0
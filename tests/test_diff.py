@@ -0,0 +1,64 @@
+import asyncio
+
+from utils.diff import diff_installs, export_entry
+from utils.extractor import FileStatus, TFIndex, known_directories
+from utils.metrics import metrics
+from utils.walker import DirectoryWalker
+
+
+async def payloads(root) -> dict[str, bytes]:
+    paths = await DirectoryWalker("index.tfi").find(root, known_directories)
+    files = {}
+    for path in paths:
+        for archive in TFIndex(path, root).archives:
+            async for file in archive.files():
+                files[file.relative_path] = bytes(await file.content)
+                file.release()
+            archive.release()
+    return files
+
+
+async def diff(old, new, export=None) -> dict[FileStatus, set[str]]:
+    statuses = {status: set() for status in FileStatus}
+    async for entry in diff_installs(old, new):
+        statuses[entry.status].add(entry.relative_path)
+        if export is not None:
+            await export_entry(entry, export)
+    return statuses
+
+
+def test_statuses_match_the_payloads(install, patched):
+    old, new = asyncio.run(payloads(install)), asyncio.run(payloads(patched))
+    statuses = asyncio.run(diff(install, patched))
+    assert statuses[FileStatus.added] == new.keys() - old.keys()
+    assert statuses[FileStatus.removed] == old.keys() - new.keys()
+    assert statuses[FileStatus.changed] == {
+        path for path in old.keys() & new.keys() if old[path] != new[path]
+    }
+    assert all(
+        statuses[status] for status in statuses if status != FileStatus.unchanged
+    )
+
+
+def test_only_metadata_mismatches_are_inflated(install, mutated):
+    root, _ = mutated
+    metrics.reset()
+    statuses = asyncio.run(diff(install, root))
+    # The mutated payload keeps the size and hash of its index entry
+    assert not any(statuses.values())
+    assert metrics.stages["inflate"].count == 0
+
+
+def test_export_saves_both_payloads(install, patched, tmp_path):
+    export = tmp_path.joinpath("export")
+    old, new = asyncio.run(payloads(install)), asyncio.run(payloads(patched))
+    statuses = asyncio.run(diff(install, patched, export))
+    for path in statuses[FileStatus.added]:
+        assert export.joinpath("new", path).read_bytes() == new[path]
+        assert not export.joinpath("old", path).exists()
+    for path in statuses[FileStatus.removed]:
+        assert export.joinpath("old", path).read_bytes() == old[path]
+        assert not export.joinpath("new", path).exists()
+    for path in statuses[FileStatus.changed]:
+        assert export.joinpath("old", path).read_bytes() == old[path]
+        assert export.joinpath("new", path).read_bytes() == new[path]
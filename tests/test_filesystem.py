@@ -0,0 +1,81 @@
+import asyncio
+import zlib
+
+import pytest
+
+from utils.filesystem import TroveFS, compile_glob
+
+
+@pytest.mark.parametrize(
+    "pattern, path, matches",
+    [
+        ("*.binfab", "en_0_1.binfab", True),
+        ("*.binfab", "languages/en_0_1.binfab", False),
+        ("**/*.binfab", "en_0_1.binfab", True),
+        ("**/*.binfab", "languages/en/en_0_1.binfab", True),
+        ("languages/**", "languages/en/en_0_1.binfab", True),
+        ("languages/*", "languages/en/en_0_1.binfab", False),
+        ("en_?_1.binfab", "en_0_1.binfab", True),
+        ("en_?_1.binfab", "en_/_1.binfab", False),
+        ("en_[01]_1.binfab", "en_1_1.binfab", True),
+        ("en_[!01]_1.binfab", "en_1_1.binfab", False),
+        ("en_0_1.binfab", "en_0_1xbinfab", False),
+    ],
+)
+def test_compile_glob(pattern, path, matches):
+    assert bool(compile_glob(pattern).match(path)) == matches
+
+
+@pytest.fixture
+def fs(install):
+    fs = asyncio.run(TroveFS.mount(install))
+    yield fs
+    fs.release()
+
+
+def test_listdir_and_stat(fs):
+    assert fs.listdir() == ["languages", "textures"]
+    assert fs.listdir("languages") == ["en"]
+    assert "en_0_0.binfab" in fs.listdir("languages/en")
+    assert fs.isdir("languages/en") and not fs.isfile("languages/en")
+    stat = fs.stat("languages\\en\\en_0_0.binfab")
+    assert not stat.is_dir and stat.offset == 0 and stat.size
+    assert fs.stat("textures").is_dir
+    with pytest.raises(FileNotFoundError):
+        fs.stat("languages/en/missing.binfab")
+    with pytest.raises(FileNotFoundError):
+        fs.listdir("missing")
+
+
+def test_glob(fs):
+    languages = fs.glob("languages/**")
+    assert languages and all(path.startswith("languages/en/") for path in languages)
+    assert fs.glob("**/*.dds") == fs.glob("textures/items/*")
+    assert len(languages) + len(fs.glob("textures/**")) == len(fs)
+
+
+def test_read_matches_the_archive(fs, install):
+    stat = fs.stat("textures/items/items_1_3.dds")
+    content = zlib.decompress(install.joinpath(stat.archive).read_bytes())
+    expected = content[stat.offset : stat.offset + stat.size]
+    assert asyncio.run(fs.read(stat.path)) == expected
+    assert asyncio.run(fs.open(stat.path)).read() == expected
+
+
+def test_least_recently_used_archives_are_released(fs):
+    fs.max_memory = 1
+
+    async def read(*paths):
+        for path in paths:
+            await fs.read(path)
+        return list(fs._archives)
+
+    first, second = "languages/en/en_0_0.binfab", "languages/en/en_1_0.binfab"
+    # The most recently used archive is always kept, whatever its size
+    assert asyncio.run(read(first, second)) == [fs.stat(second).archive]
+    assert asyncio.run(read(first)) == [fs.stat(first).archive]
+    fs.max_memory = 1024**3
+    assert asyncio.run(read(second, first)) == [
+        fs.stat(second).archive,
+        fs.stat(first).archive,
+    ]
@@ -0,0 +1,76 @@
+import asyncio
+import re
+
+import pytest
+
+from utils.extractor import TFIndex, known_directories
+from utils.grep import ContentGrep, GrepMatch
+from utils.search import CatalogSearch
+from utils.walker import DirectoryWalker
+
+
+@pytest.fixture
+def catalog(install):
+    async def build():
+        paths = await DirectoryWalker("index.tfi").find(install, known_directories)
+        return await CatalogSearch.build(TFIndex(path, install) for path in paths)
+
+    return asyncio.run(build())
+
+
+async def expected(catalog, expression: re.Pattern) -> set[GrepMatch]:
+    matches = set()
+    for row, file in enumerate(catalog.prefix("").files()):
+        for match in expression.finditer(await file.content):
+            matches.add(GrepMatch(catalog.paths[row], match.start()))
+        file.release()
+    return matches
+
+
+async def grep(catalog, pattern: bytes, **kwargs) -> set[GrepMatch]:
+    searcher = ContentGrep(pattern, workers=2, **kwargs)
+    return {match async for match in searcher.search(catalog.prefix("").files())}
+
+
+def test_literal_matches(catalog):
+    matches = asyncio.run(grep(catalog, b"cornerstone"))
+    assert matches
+    assert matches == asyncio.run(expected(catalog, re.compile(b"cornerstone")))
+
+
+def test_ignore_case_matches(catalog):
+    matches = asyncio.run(grep(catalog, b"CornerStone", ignore_case=True))
+    assert matches == asyncio.run(
+        expected(catalog, re.compile(b"cornerstone", re.IGNORECASE))
+    )
+    assert not asyncio.run(grep(catalog, b"CornerStone"))
+
+
+def test_regex_matches(catalog):
+    pattern = rb"\$prefab_\w+|dragon gem"
+    matches = asyncio.run(grep(catalog, pattern, regex=True))
+    assert matches
+    assert matches == asyncio.run(expected(catalog, re.compile(pattern)))
+
+
+def test_tiny_budget_scans_archives_one_at_a_time(catalog):
+    matches = asyncio.run(grep(catalog, b"trove", memory_budget=1))
+    assert matches == asyncio.run(expected(catalog, re.compile(b"trove")))
+
+
+def test_reservations_wait_for_room_in_the_budget():
+    async def run():
+        searcher = ContentGrep(b"trove", memory_budget=15)
+        await searcher._reserve(10)
+        waiting = asyncio.create_task(searcher._reserve(10))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        await searcher._free(10)
+        await waiting
+        assert searcher._reserved == 10
+        await searcher._free(10)
+        # An archive larger than the budget goes through once nothing is held
+        await searcher._reserve(100)
+        assert searcher._reserved == 100
+
+    asyncio.run(run())
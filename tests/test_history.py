@@ -0,0 +1,51 @@
+import pytest
+
+from utils.history import HistoryStatus, PatchHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = PatchHistory(tmp_path.joinpath("history.db"))
+    yield history
+    history.close()
+
+
+def test_record_modify_remove(history):
+    first = history.record("live", [("a.txt", 1, 10), ("b.txt", 2, 20)])
+    second = history.record("live", [("a.txt", 1, 11), ("b.txt", 2, 20)])
+    third = history.record("live", [("b.txt", 2, 20), ("c.txt", 3, 30)])
+    assert [s.id for s in history.snapshots("live")] == [
+        first.id,
+        second.id,
+        third.id,
+    ]
+    assert [(e.path, e.status) for e in history.changes(first.id, second.id)] == [
+        ("a.txt", HistoryStatus.changed)
+    ]
+    assert [(e.path, e.status) for e in history.changes(second.id, third.id)] == [
+        ("a.txt", HistoryStatus.removed),
+        ("c.txt", HistoryStatus.added),
+    ]
+    assert [(e.path, e.status) for e in history.changes(first.id, third.id)] == [
+        ("a.txt", HistoryStatus.removed),
+        ("c.txt", HistoryStatus.added),
+    ]
+    assert history.last_changed("live", "a.txt").id == third.id
+    assert history.last_changed("live", "b.txt").id == first.id
+    assert history.last_changed("live", "d.txt") is None
+
+
+def test_sources_are_kept_apart(history):
+    live = history.record("live", [("a.txt", 1, 10)])
+    pts = history.record("pts", [("a.txt", 1, 11)])
+    assert [s.id for s in history.snapshots("live")] == [live.id]
+    assert history.last_changed("pts", "a.txt").id == pts.id
+    with pytest.raises(ValueError):
+        history.changes(live.id, pts.id)
+
+
+def test_unchanged_fingerprint_is_not_recorded(history):
+    assert history.record("live", [("a.txt", 1, 10)], "abc") is not None
+    assert history.record("live", [("a.txt", 1, 11)], "abc") is None
+    assert history.record("live", [("a.txt", 1, 11)], "def") is not None
+    assert len(history.snapshots("live")) == 2
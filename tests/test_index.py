@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+
+from utils.extractor import TFIndex
+from utils.memory import BudgetAction, MemoryBudgetExceeded, memory
+
+
+def test_empty_index_is_parsed_once(tmp_path):
+    path = tmp_path.joinpath("empty", "index.tfi")
+    path.parent.mkdir()
+    path.write_bytes(b"")
+    index = TFIndex(path, tmp_path)
+    held = memory.live["index"]
+    assert asyncio.run(index.files_list) == []
+    accounted = memory.live["index"] - held
+    assert asyncio.run(index.files_list) == []
+    assert memory.live["index"] - held == accounted
+
+
+def test_index_over_budget_is_left_unparsed(install):
+    index = TFIndex(next(install.rglob("index.tfi")), install)
+    held = memory.live["index"]
+    memory.acquire("archive", 1)
+    memory.configure(memory.total, BudgetAction.abort)
+    try:
+        with pytest.raises(MemoryBudgetExceeded):
+            asyncio.run(index.files_list)
+    finally:
+        memory.release("archive", 1)
+        memory.configure(None)
+    assert memory.live["index"] == held
+    files = asyncio.run(index.files_list)
+    assert files
+    assert asyncio.run(index.totals).files == len(files)
@@ -0,0 +1,56 @@
+import asyncio
+import zlib
+
+from utils.cache import InflateCache
+from utils.extractor import TFIndex, known_directories
+from utils.metrics import metrics
+from utils.walker import DirectoryWalker
+
+
+async def read_install(root, cache):
+    paths = await DirectoryWalker("index.tfi").find(root, known_directories)
+    files = 0
+    for path in paths:
+        index = TFIndex(path, root, cache)
+        for archive in index.archives:
+            async for file in archive.files():
+                await file.content
+                file.release()
+                files += 1
+            archive.release()
+    return files
+
+
+async def inflate_in_two_steps(root):
+    paths = await DirectoryWalker("index.tfi").find(root, known_directories)
+    archives = 0
+    for path in paths:
+        index = TFIndex(path, root)
+        for archive in index.archives:
+            expected = zlib.decompress(archive.path.read_bytes())
+            middle = await archive.expected_size // 2
+            partial = bytes(await archive.content_until(middle))
+            assert len(partial) >= middle
+            assert expected.startswith(partial)
+            assert bytes(await archive.content) == expected
+            archive.release()
+            archives += 1
+    return archives
+
+
+def test_partial_then_full_inflate_matches_zlib(install):
+    assert asyncio.run(inflate_in_two_steps(install))
+
+
+def test_partial_reads_fill_the_cache(install, tmp_path):
+    cache = InflateCache(tmp_path.joinpath("cache"), 64 * 1024**2)
+    assert asyncio.run(read_install(install, cache))
+    assert cache.size > 0
+
+
+def test_second_read_is_served_from_the_cache(install, tmp_path):
+    cache = InflateCache(tmp_path.joinpath("cache"), 64 * 1024**2)
+    asyncio.run(read_install(install, cache))
+    metrics.reset()
+    asyncio.run(read_install(install, cache))
+    assert metrics.stages["inflate"].count == 0
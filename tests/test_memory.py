@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from utils.memory import BudgetAction, MemoryBudgetExceeded, MemoryGovernor
+
+
+def test_reserve_settle_release():
+    governor = MemoryGovernor()
+    asyncio.run(governor.reserve("archive", 100, "inflate"))
+    assert governor.settle("archive", 100, 60) == 60
+    assert governor.live["archive"] == 60 and governor.peak["archive"] == 100
+    assert governor.settle("archive", 60, 80) == 80
+    governor.release("archive", 80)
+    assert governor.total == 0
+    assert governor.peak_total == 100 and governor.stages["inflate"] == 100
+
+
+def test_abort_over_budget():
+    governor = MemoryGovernor()
+    governor.configure(100, BudgetAction.abort)
+    # Nothing else is held, so even an archive over the budget goes through
+    governor.acquire("archive", 150)
+    with pytest.raises(MemoryBudgetExceeded):
+        governor.acquire("index", 10, "parse")
+    assert governor.live == {"archive": 150, "file": 0, "index": 0}
+
+
+def test_throttle_waits_for_a_release():
+    governor = MemoryGovernor()
+    governor.configure(100, BudgetAction.throttle)
+
+    async def run():
+        await governor.reserve("archive", 60)
+        waiting = asyncio.create_task(governor.reserve("archive", 60))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        # Files have a share of their own and do not wait on archives
+        await asyncio.wait_for(governor.reserve("file", 20), 1)
+        governor.release("archive", 60)
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(run())
+    assert governor.live["archive"] == 60 and governor.waits == 1
+
+
+def test_throttle_timeout_is_opt_in():
+    governor = MemoryGovernor()
+    governor.configure(100, BudgetAction.throttle, timeout=0.05)
+
+    async def run():
+        await governor.reserve("archive", 60)
+        with pytest.raises(MemoryBudgetExceeded):
+            await governor.reserve("archive", 60)
+        governor.configure(100, BudgetAction.throttle)
+        waiting = asyncio.create_task(governor.reserve("archive", 60))
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        waiting.cancel()
+
+    asyncio.run(run())
+    assert governor.live["archive"] == 60
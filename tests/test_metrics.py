@@ -0,0 +1,17 @@
+import asyncio
+
+from utils.metrics import metrics
+
+
+def test_stages_measured_from_threads_are_all_counted():
+    async def hash_concurrently():
+        def work():
+            for _ in range(1000):
+                with metrics.measure("hash", 1):
+                    pass
+
+        await asyncio.gather(*[asyncio.to_thread(work) for _ in range(8)])
+
+    metrics.reset()
+    asyncio.run(hash_concurrently())
+    assert metrics.stages["hash"].count == metrics.stages["hash"].bytes == 8000
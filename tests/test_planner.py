@@ -0,0 +1,39 @@
+import asyncio
+import random
+
+from utils.extractor import TFIndex, known_directories
+from utils.planner import ExtractionPlan
+from utils.search import CatalogSearch
+from utils.walker import DirectoryWalker
+
+
+def shuffled_files(install):
+    async def build():
+        paths = await DirectoryWalker("index.tfi").find(install, known_directories)
+        return await CatalogSearch.build(TFIndex(path, install) for path in paths)
+
+    files = asyncio.run(build()).prefix("").files()
+    random.Random(0).shuffle(files)
+    return files
+
+
+def test_reads_follow_offsets_and_writes_follow_paths(install):
+    files = shuffled_files(install)
+    plan = ExtractionPlan(files)
+    archives = [archive_plan.archive.relative_path for archive_plan in plan]
+    assert archives == sorted(set(archives)) and len(archives) == 4
+    for archive_plan in plan:
+        offsets = [file.offset for file in archive_plan.files]
+        assert offsets == sorted(offsets)
+        paths = [file.relative_path for file in archive_plan.writes]
+        assert paths == sorted(paths) and paths != [
+            file.relative_path for file in archive_plan.files
+        ]
+        assert archive_plan.end == archive_plan.files[-1].offset + (
+            archive_plan.files[-1].size
+        )
+    assert [file.relative_path for file in plan.writes] == sorted(
+        file.relative_path for file in files
+    )
+    assert len(plan) == len(files)
+    assert plan.size == sum(file.size for file in files)
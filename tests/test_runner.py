@@ -0,0 +1,10 @@
+import pytest
+
+from benchmarks.runner import parse_args
+
+
+def test_repeat_must_be_positive(capsys):
+    assert parse_args(["--repeat", "1"]).repeat == 1
+    with pytest.raises(SystemExit):
+        parse_args(["--repeat", "0"])
+    assert "--repeat must be at least 1" in capsys.readouterr().err
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from utils.extractor import TFIndex, known_directories
+from utils.search import CatalogSearch
+from utils.walker import DirectoryWalker
+
+
+async def build(root) -> CatalogSearch:
+    paths = await DirectoryWalker("index.tfi").find(root, known_directories)
+    return await CatalogSearch.build(TFIndex(path, root) for path in paths)
+
+
+@pytest.fixture
+def catalog(install):
+    return asyncio.run(build(install))
+
+
+def test_paths_are_sorted(catalog):
+    assert catalog.paths == sorted(catalog.paths)
+    assert (
+        len(catalog)
+        == catalog.totals.files
+        == sum(totals.files for totals in catalog.index_totals.values())
+    )
+
+
+def test_find(catalog):
+    row = catalog.find("languages\\en\\en_0_3.binfab")
+    assert catalog.paths[row] == "languages/en/en_0_3.binfab"
+    assert catalog.find("languages/en/en_0_3") is None
+    assert catalog.find("zzz") is None
+
+
+def test_prefix_stops_at_the_upper_bound(catalog):
+    archive = list(catalog.prefix("languages/en/en_1_"))
+    assert archive and all(path.startswith("languages/en/en_1_") for path in archive)
+    assert len(archive) == sum(
+        path.startswith("languages/en/en_1_") for path in catalog.paths
+    )
+    last = catalog.paths[-1]
+    assert list(catalog.prefix(last)) == [last]
+    assert not catalog.prefix(last + "~")
+    assert len(catalog.prefix("")) == len(catalog)
+
+
+def test_glob_and_regex(catalog):
+    dds = catalog.glob("**/*.dds")
+    assert list(dds) == [path for path in catalog.paths if path.endswith(".dds")]
+    assert list(catalog.glob("textures/items/*_0_?.dds")) == [
+        f"textures/items/items_0_{i}.dds" for i in range(10)
+    ]
+    assert list(catalog.regex(r"_1_3\d\.")) == [
+        f"{directory}_1_3{i}.{extension}"
+        for directory, extension in [
+            ("languages/en/en", "binfab"),
+            ("textures/items/items", "dds"),
+        ]
+        for i in range(10)
+    ]
+    assert dds.size == sum(catalog.sizes[row] for row in dds.rows)
+
+
+def test_entries_of_missing_archives_are_left_out(install):
+    install.joinpath("textures", "items", "archive1.tfa").unlink()
+    catalog = asyncio.run(build(install))
+    assert not catalog.glob("textures/items/items_1_*")
+    files = catalog.glob("textures/**").files()
+    assert files and all(file.archive.id == 0 for file in files)
+    assert catalog.index_totals[files[0].archive.index.relative_path].files == len(
+        files
+    )
@@ -0,0 +1,19 @@
+import json
+
+from utils.tracing import Tracer
+
+
+def test_events_past_the_cap_are_dropped(tmp_path):
+    tracer = Tracer(max_events=3)
+    tracer.enable()
+    for _ in range(5):
+        with tracer.span("file", "write"):
+            pass
+    # One thread name event and two spans fit under the cap
+    assert len(tracer.events) == 3
+    assert tracer.dropped == 3
+    tracer.save(tmp_path.joinpath("trace.json"))
+    trace = json.loads(tmp_path.joinpath("trace.json").read_text())
+    assert trace["otherData"]["droppedEvents"] == 3
+    tracer.reset()
+    assert not tracer.events and not tracer.dropped
@@ -0,0 +1,95 @@
+import asyncio
+import zlib
+
+import pytest
+
+from benchmarks.corpus import write_varint
+from utils.extractor import TFIndex, known_directories, parse_index
+from utils.search import CatalogSearch
+from utils.trigrams import TrigramIndex, is_text
+from utils.walker import DirectoryWalker
+
+
+async def build(root) -> CatalogSearch:
+    paths = await DirectoryWalker("index.tfi").find(root, known_directories)
+    return await CatalogSearch.build(TFIndex(path, root) for path in paths)
+
+
+def prefix_archive(directory, archive_id: int, prefix: bytes) -> list[str]:
+    """Overwrites the start of every file of an archive, keeping their sizes,
+    and returns the names of the files whose payload is text."""
+    index_path = directory.joinpath("index.tfi")
+    archive_path = directory.joinpath(f"archive{archive_id}.tfa")
+    content = bytearray(zlib.decompress(archive_path.read_bytes()))
+    index, text = bytearray(), []
+    for entry in parse_index(index_path.read_bytes()):
+        crc = entry.hash
+        if entry.archive_index == archive_id and entry.size >= len(prefix):
+            content[entry.offset : entry.offset + len(prefix)] = prefix
+            payload = content[entry.offset : entry.offset + entry.size]
+            crc = zlib.crc32(payload)
+            if is_text(payload):
+                text.append(entry.name)
+        encoded = entry.name.encode()
+        index += write_varint(len(encoded)) + encoded
+        index += write_varint(entry.archive_index) + write_varint(entry.offset)
+        index += write_varint(entry.size) + write_varint(crc)
+    archive_path.write_bytes(zlib.compress(content))
+    index_path.write_bytes(index)
+    return text
+
+
+@pytest.fixture
+def trigram_index(tmp_path):
+    trigram_index = TrigramIndex(tmp_path.joinpath("trigrams.db"))
+    yield trigram_index
+    trigram_index.close()
+
+
+def test_only_changed_files_are_indexed_again(install, trigram_index):
+    catalog = asyncio.run(build(install))
+    texts = len(catalog.prefix("languages/"))
+    assert asyncio.run(trigram_index.update(catalog)) == (texts, 0)
+    assert asyncio.run(trigram_index.update(catalog)) == (0, 0)
+    assert not trigram_index.candidates("needle")
+    names = prefix_archive(install.joinpath("languages", "en"), 1, b"Needle ")
+    catalog = asyncio.run(build(install))
+    changed = len(catalog.prefix("languages/en/en_1_"))
+    assert asyncio.run(trigram_index.update(catalog)) == (changed, 0)
+    assert len(trigram_index) == texts
+    assert trigram_index.candidates("NEEDLE") == sorted(
+        f"languages/en/{name}" for name in names
+    )
+
+
+def test_candidates_hold_every_verified_match(install, trigram_index):
+    catalog = asyncio.run(build(install))
+    asyncio.run(trigram_index.update(catalog))
+
+    async def matches(text: bytes) -> list[str]:
+        found = []
+        for file in catalog.prefix("languages/").files():
+            payload = await file.content
+            if is_text(payload) and text in payload.lower():
+                found.append(catalog.paths[catalog.find(file.relative_path)])
+            file.release()
+        return found
+
+    verified = asyncio.run(matches(b"cornerstone"))
+    candidates = trigram_index.candidates("Cornerstone")
+    assert verified and set(verified) <= set(candidates)
+    with pytest.raises(ValueError):
+        trigram_index.candidates("ab")
+
+
+def test_removed_files_are_pruned(install, trigram_index):
+    catalog = asyncio.run(build(install))
+    asyncio.run(trigram_index.update(catalog))
+    install.joinpath("languages", "en", "archive0.tfa").unlink()
+    catalog = asyncio.run(build(install))
+    removed = len(trigram_index) - len(catalog.prefix("languages/"))
+    assert removed
+    assert asyncio.run(trigram_index.update(catalog)) == (0, removed)
+    candidates = trigram_index.candidates("trove")
+    assert candidates
+    assert not any(path.startswith("languages/en/en_0_") for path in candidates)
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from utils.walker import DirectoryWalker
+
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path.joinpath("install")
+    for directory in ["languages/en", "languages/fr", "textures/items"]:
+        root.joinpath(directory).mkdir(parents=True)
+    root.joinpath("languages", "en", "index.tfi").write_bytes(b"")
+    root.joinpath("textures", "items", "index.tfi").write_bytes(b"")
+    return root
+
+
+def find(root, cache_path) -> list[str]:
+    walker = DirectoryWalker("index.tfi", cache_path)
+    paths = asyncio.run(walker.find(root, ["languages", "textures"]))
+    return [path.parent.relative_to(root).as_posix() for path in paths]
+
+
+def test_unchanged_directories_are_not_listed_again(root, tmp_path):
+    cache_path = tmp_path.joinpath("directories.json")
+    assert find(root, cache_path) == ["languages/en", "textures/items"]
+    french = root.joinpath("languages", "fr")
+    mtime = french.stat().st_mtime_ns
+    french.joinpath("index.tfi").write_bytes(b"")
+    # With its mtime restored the directory is taken from the cache
+    os.utime(french, ns=(mtime, mtime))
+    assert find(root, cache_path) == ["languages/en", "textures/items"]
+    os.utime(french, ns=(mtime + 10**9, mtime + 10**9))
+    assert find(root, cache_path) == [
+        "languages/en",
+        "languages/fr",
+        "textures/items",
+    ]
+
+
+def test_removed_and_added_indexes(root, tmp_path):
+    cache_path = tmp_path.joinpath("directories.json")
+    find(root, cache_path)
+    root.joinpath("textures", "items", "index.tfi").unlink()
+    root.joinpath("textures", "blocks").mkdir()
+    root.joinpath("textures", "blocks", "index.tfi").write_bytes(b"")
+    assert find(root, cache_path) == ["languages/en", "textures/blocks"]
+
+
+def test_corrupt_cache_is_rebuilt(root, tmp_path, capsys):
+    cache_path = tmp_path.joinpath("directories.json")
+    cache_path.write_text("{not json")
+    assert find(root, cache_path) == ["languages/en", "textures/items"]
+    assert "malformed" in capsys.readouterr().out
+    data = json.loads(cache_path.read_text())
+    assert data["look_for"] == "index.tfi" and data["layout"]
+
+
+def test_cache_of_another_version_or_file_is_ignored(root, tmp_path):
+    cache_path = tmp_path.joinpath("directories.json")
+    find(root, cache_path)
+    assert DirectoryWalker("index.tfi", cache_path).layout
+    assert DirectoryWalker("archive0.tfa", cache_path).layout == {}
+    data = json.loads(cache_path.read_text())
+    data["version"] = DirectoryWalker.version + 1
+    cache_path.write_text(json.dumps(data))
+    assert DirectoryWalker("index.tfi", cache_path).layout == {}
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+from utils.cache import InflateCache
+from utils.extractor import (
+    FileStatus,
+    TFArchive,
+    TFIndex,
+    TroveFile,
+    find_all_indexes,
+)
+from utils.tracing import tracer
+from utils.walker import DirectoryWalker
+
+
+async def gather_or_cancel(*aws):
+    """Like asyncio.gather, but cancels the other awaitables as soon as one of
+    them fails instead of leaving them running."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+class BatchMode(Enum):
+    all = "All"
+    changes = "Changes"
+    diff = "Diff"
+
+
+class BatchInstall:
+    def __init__(self, root: Path, extract_to: Optional[Path] = None):
+        self.root = root
+        self.extract_to = extract_to or root.joinpath("extracted")
+        self.hashes_path = self.extract_to.joinpath("hashes.json")
+        self.hashes = dict()
+        if self.hashes_path.exists():
+            try:
+                self.hashes = json.loads(self.hashes_path.read_text())
+            except json.JSONDecodeError:
+                print("Failed to load hashes, malformed file.")
+        self.indexes: list[TFIndex] = []
+        self.changes: list[TroveFile] = []
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def __str__(self):
+        return f"<root={str(self.root)} extract_to={str(self.extract_to)}>"
+
+    def save_hashes(self):
+        self.hashes_path.parent.mkdir(parents=True, exist_ok=True)
+        self.hashes_path.write_text(json.dumps(self.hashes, indent=4))
+
+
+class BatchExtractor:
+    """Extracts or diffs several installs in one pass.
+
+    Archives with the same compressed digest are inflated once and shared
+    between every install holding them. The number of archives in flight and
+    of concurrent file operations is shared by all installs."""
+
+    def __init__(
+        self,
+        installs: list[BatchInstall],
+        mode: BatchMode = BatchMode.changes,
+        archives_limit: Optional[int] = None,
+        io_limit: int = 16,
+        cache: Optional[InflateCache] = None,
+        use_hashes: bool = False,
+    ):
+        self.installs = installs
+        self.mode = mode
+        self.archives = asyncio.Semaphore(archives_limit or os.cpu_count() or 1)
+        self.io = asyncio.Semaphore(io_limit)
+        self.cache = cache
+        self.use_hashes = use_hashes
+        self.archives_total = 0
+        self.archives_shared = 0
+        self.archives_skipped = 0
+
+    async def discover(self, install: BatchInstall):
+        walker = DirectoryWalker(
+            "index.tfi", install.extract_to.joinpath("directories.json")
+        )
+        install.indexes = [
+            index
+            async for index in find_all_indexes(
+                install.root, install.hashes, False, walker, self.cache
+            )
+        ]
+
+    async def group_archives(self) -> list[list[tuple[BatchInstall, TFArchive]]]:
+        archives = [
+            (install, archive)
+            for install in self.installs
+            for index in install.indexes
+            for archive in index.archives
+        ]
+        self.archives_total = len(archives)
+        hashes = await asyncio.gather(
+            *[archive.content_hash for _, archive in archives]
+        )
+        groups: dict[str, list[tuple[BatchInstall, TFArchive]]] = {}
+        for (install, archive), archive_hash in zip(archives, hashes):
+            if (
+                self.use_hashes
+                and self.mode != BatchMode.all
+                and install.hashes.get(archive.relative_path) == archive_hash
+            ):
+                self.archives_skipped += 1
+                continue
+            groups.setdefault(archive_hash, []).append((install, archive))
+        return list(groups.values())
+
+    async def run(self):
+        await asyncio.gather(*[self.discover(install) for install in self.installs])
+        groups = await self.group_archives()
+        self.archives_shared = sum(len(group) - 1 for group in groups)
+        await gather_or_cancel(*[self.process(group) for group in groups])
+        if self.mode == BatchMode.diff:
+            return
+        for install in self.installs:
+            for index in install.indexes:
+                install.hashes[index.relative_path] = await index.content_hash
+            install.save_hashes()
+
+    async def process(self, group: list[tuple[BatchInstall, TFArchive]]):
+        async with self.archives:
+            source = group[0][1]
+            with tracer.span("archive", "archive", archive=source.relative_path):
+                await source.content
+            # Each archive takes the buffer over from the previous one, so it
+            # stays accounted until the last archive of the group releases it
+            for (_, previous), (_, archive) in zip(group, group[1:]):
+                archive.share_content(previous)
+            for install, archive in group:
+                with tracer.span(
+                    "files",
+                    "write",
+                    archive=archive.relative_path,
+                    mode=self.mode.value,
+                ):
+                    await gather_or_cancel(
+                        *[
+                            self.process_file(install, file)
+                            async for file in archive.files()
+                        ]
+                    )
+                if self.mode != BatchMode.diff:
+                    install.hashes[archive.relative_path] = await archive.content_hash
+                archive.release()
+
+    async def process_file(self, install: BatchInstall, file: TroveFile):
+        async with self.io:
+            if self.mode != BatchMode.all:
+                status = await file.compare(install.extract_to)
+                if status not in [FileStatus.added, FileStatus.changed]:
+                    file.release()
+                    return
+                install.changes.append(file)
+            if self.mode != BatchMode.diff:
+                await file.save(install.extract_to)
+                install.files_written += 1
+                install.bytes_written += file.size
+            file.release()
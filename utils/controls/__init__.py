@@ -1,3 +1,4 @@
 from .appbar import TFAExtractionAppBar
 from .scrolling import ScrollingFrame
 from .inputs import AutoNumberField, NumberField, PathField
+from .files import FilesList
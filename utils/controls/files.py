@@ -0,0 +1,183 @@
+from array import array
+from typing import Iterable, Optional
+
+import flet as ft
+from humanize import naturalsize
+
+from utils.search import ScanResult
+
+
+class FilesList(ft.UserControl):
+    """Paginated table over the rows of a scan result.
+
+    Filtering and sorting happen on the compact scan result and only the rows
+    of the current page are ever sent to the UI, so large patches can be
+    browsed without building one control per changed file."""
+
+    def __init__(self, page_size: int = 100, expand=True, **kwargs):
+        super().__init__(expand=expand, **kwargs)
+        self.page_size = page_size
+        self.result: Optional[ScanResult] = None
+        self.indexes: Optional[set[str]] = None
+        self.query = ""
+        self.sort_column = 0
+        self.sort_ascending = True
+        self.view = array("I")
+        self.page_number = 0
+        self.filter_field = ft.TextField(
+            label="Filter by path",
+            dense=True,
+            expand=True,
+            on_submit=self.filter,
+        )
+        self.page_text = ft.Text("")
+        self.previous_button = ft.IconButton(
+            ft.icons.CHEVRON_LEFT, on_click=self.previous_page, disabled=True
+        )
+        self.next_button = ft.IconButton(
+            ft.icons.CHEVRON_RIGHT, on_click=self.next_page, disabled=True
+        )
+        self.table = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("Path"), on_sort=self.sort),
+                ft.DataColumn(ft.Text("Size"), on_sort=self.sort, numeric=True),
+            ],
+            column_spacing=15,
+            heading_row_height=35,
+            data_row_height=25,
+            sort_column_index=0,
+            sort_ascending=True,
+        )
+
+    def build(self):
+        return ft.Column(
+            controls=[
+                ft.Row(
+                    controls=[
+                        self.filter_field,
+                        self.previous_button,
+                        self.page_text,
+                        self.next_button,
+                    ]
+                ),
+                ft.Column(controls=[self.table], expand=True, scroll="auto"),
+            ],
+            expand=True,
+        )
+
+    def load(self, result: Optional[ScanResult], message: Optional[str] = None):
+        """Shows the rows of a scan result, or a message in their place."""
+        self.result = result
+        self.indexes = None
+        self.page_number = 0
+        if message is not None or result is None:
+            self.view = array("I")
+            self._show_message(message or "")
+            return
+        self.refresh()
+
+    def show_indexes(self, paths: Optional[Iterable[str]]):
+        """Only shows the rows of the given index relative paths."""
+        self.indexes = set(paths) if paths is not None else None
+        self.page_number = 0
+        self.refresh()
+
+    def refresh(self):
+        """Applies the filters and sorting to the rows of the result again."""
+        if self.result is None:
+            return
+        catalog = self.result.catalog
+        rows = self.result.rows
+        query = self.query.lower()
+        positions = range(len(rows))
+        if self.indexes is not None:
+            indexes = self.indexes
+            positions = [
+                p
+                for p in positions
+                if catalog.indexes[rows[p]].relative_path in indexes
+            ]
+        if query:
+            paths = catalog.paths
+            positions = [p for p in positions if query in paths[rows[p]].lower()]
+        if self.sort_column == 1:
+            sizes = catalog.sizes
+            positions = sorted(
+                positions,
+                key=lambda p: sizes[rows[p]],
+                reverse=not self.sort_ascending,
+            )
+        elif not self.sort_ascending:
+            # Rows are kept in path order already
+            positions = reversed(positions)
+        self.view = array("I", positions)
+        self._render()
+
+    def _render(self):
+        pages = max((len(self.view) - 1) // self.page_size + 1, 1)
+        self.page_number = min(self.page_number, pages - 1)
+        start = self.page_number * self.page_size
+        end = min(start + self.page_size, len(self.view))
+        catalog = self.result.catalog
+        self.table.rows = []
+        for position in self.view[start:end]:
+            row = self.result.rows[position]
+            color = self.result.status(position).color
+            self.table.rows.append(
+                ft.DataRow(
+                    data=row,
+                    cells=[
+                        ft.DataCell(ft.Text(catalog.paths[row], color=color, size=12)),
+                        ft.DataCell(
+                            ft.Text(
+                                naturalsize(catalog.sizes[row], gnu=True),
+                                color=color,
+                                size=12,
+                            )
+                        ),
+                    ],
+                )
+            )
+        self.page_text.value = (
+            f"{start + 1}-{end} of {len(self.view)}" if self.view else "0 of 0"
+        )
+        self.previous_button.disabled = not self.page_number
+        self.next_button.disabled = self.page_number >= pages - 1
+
+    def _show_message(self, message: str, color: Optional[str] = None):
+        self.table.rows = [
+            ft.DataRow(
+                cells=[
+                    ft.DataCell(ft.Text(message, color=color)),
+                    ft.DataCell(ft.Text("")),
+                ]
+            )
+        ]
+        self.page_text.value = ""
+        self.previous_button.disabled = True
+        self.next_button.disabled = True
+
+    async def filter(self, event):
+        self.query = event.control.value.strip()
+        self.page_number = 0
+        self.refresh()
+        await self.update_async()
+
+    async def sort(self, event):
+        self.sort_column = event.column_index
+        self.sort_ascending = event.ascending
+        self.table.sort_column_index = event.column_index
+        self.table.sort_ascending = event.ascending
+        self.page_number = 0
+        self.refresh()
+        await self.update_async()
+
+    async def previous_page(self, _):
+        self.page_number = max(self.page_number - 1, 0)
+        self._render()
+        await self.update_async()
+
+    async def next_page(self, _):
+        self.page_number += 1
+        self._render()
+        await self.update_async()
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import AsyncGenerator, NamedTuple, Optional
+
+from utils.cache import InflateCache
+from utils.extractor import FileStatus, TFIndex, TroveFile, find_all_indexes
+
+
+class DiffEntry(NamedTuple):
+    relative_path: str
+    status: FileStatus
+    old: Optional[TroveFile]
+    new: Optional[TroveFile]
+
+    @property
+    def size(self) -> int:
+        return (self.new or self.old).size
+
+
+async def index_files(index: TFIndex) -> dict[str, TroveFile]:
+    files = {}
+    for archive in index.archives:
+        async for file in archive.files():
+            files[file.name] = file
+    return files
+
+
+def release_index(files: dict[str, TroveFile]):
+    for file in files.values():
+        file.release()
+        file.archive.release()
+
+
+async def diff_indexes(
+    old: Optional[TFIndex], new: Optional[TFIndex]
+) -> AsyncGenerator[DiffEntry]:
+    old_files = await index_files(old) if old is not None else {}
+    new_files = await index_files(new) if new is not None else {}
+    candidates = []
+    for name in sorted(old_files.keys() | new_files.keys()):
+        old_file, new_file = old_files.get(name), new_files.get(name)
+        if old_file is None:
+            yield DiffEntry(new_file.relative_path, FileStatus.added, None, new_file)
+        elif new_file is None:
+            yield DiffEntry(old_file.relative_path, FileStatus.removed, old_file, None)
+        elif (old_file.size, old_file.hash) != (new_file.size, new_file.hash):
+            candidates.append((old_file, new_file))
+    # Payloads are read in archive and offset order of the new install
+    candidates.sort(key=lambda pair: (pair[1].archive_index, pair[1].offset))
+    for old_file, new_file in candidates:
+        if await old_file.content_hash != await new_file.content_hash:
+            yield DiffEntry(
+                new_file.relative_path, FileStatus.changed, old_file, new_file
+            )
+        old_file.release()
+        new_file.release()
+    release_index(old_files)
+    release_index(new_files)
+
+
+async def diff_installs(
+    old_root: Path, new_root: Path, cache: Optional[InflateCache] = None
+) -> AsyncGenerator[DiffEntry]:
+    """Lines up the catalogs of two installs and yields every file that differs.
+
+    Files with the same size and TFI hash are considered unchanged, payloads are
+    only inflated when that metadata differs. Indexes are diffed one at a time
+    and their buffers released before moving on to the next one."""
+    old_indexes = {
+        index.relative_path: index
+        async for index in find_all_indexes(old_root, {}, False, cache=cache)
+    }
+    new_indexes = {
+        index.relative_path: index
+        async for index in find_all_indexes(new_root, {}, False, cache=cache)
+    }
+    for relative_path in sorted(old_indexes.keys() | new_indexes.keys()):
+        async for entry in diff_indexes(
+            old_indexes.get(relative_path), new_indexes.get(relative_path)
+        ):
+            yield entry
+
+
+async def export_entry(entry: DiffEntry, path: Path):
+    if entry.old is not None:
+        await entry.old.save(path.joinpath("old"))
+        entry.old.release()
+    if entry.new is not None:
+        await entry.new.save(path.joinpath("new"))
+        entry.new.release()
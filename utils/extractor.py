@@ -1,17 +1,39 @@
 from __future__ import annotations
 
+import asyncio
+import os
 import re
+import sys
 import zlib
-from copy import copy
 from enum import Enum
 from hashlib import md5
 from pathlib import Path
-from typing import Generator, Optional
+from typing import Generator, NamedTuple, Optional
 
 import aiofiles
-from binary_reader import BinaryReader
+
+from utils.cache import InflateCache
+from utils.mapping import MappedFile
+from utils.memory import memory
+from utils.metrics import metrics
+from utils.tracing import tracer
+from utils.walker import DirectoryWalker
 
 archive_id = re.compile(r"^archive(\d+)")
+CHUNK_SIZE = 1 << 16
+known_directories = [
+    "audio",
+    "blueprints",
+    "fonts",
+    "languages",
+    "models",
+    "movies",
+    "particles",
+    "prefabs",
+    "shadersunified",
+    "textures",
+    "ui",
+]
 
 
 class FileStatus(Enum):
@@ -20,18 +42,93 @@ class FileStatus(Enum):
     changed = "Changed"
     removed = "Removed"
 
+    @property
+    def color(self) -> Optional[str]:
+        if self == FileStatus.added:
+            return "green"
+        if self == FileStatus.changed:
+            return "yellow"
+        if self == FileStatus.removed:
+            return "red"
+        return None
+
+
+class TFIEntry(NamedTuple):
+    name: str
+    archive_index: int
+    offset: int
+    size: int
+    hash: int
+
+
+class Totals:
+    """File count, bytes and inflated end offset of a group of entries."""
+
+    __slots__ = ("files", "bytes", "end")
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.end = 0
+
+    def add(self, entry: TFIEntry):
+        self.files += 1
+        self.bytes += entry.size
+        self.end = max(self.end, entry.offset + entry.size)
+
 
 class TroveFile:
-    def __init__(self, **data):
-        for key, value in data.items():
-            setattr(self, key, value)
+    __slots__ = (
+        "archive",
+        "entry",
+        "_relative_path",
+        "_content",
+        "_content_hash",
+        "_status",
+    )
+
+    def __init__(
+        self,
+        archive: TFArchive,
+        entry: TFIEntry,
+        status: Optional[FileStatus] = None,
+    ):
+        self.archive = archive
+        self.entry = entry
+        self._relative_path: Optional[str] = None
         self._content: Optional[bytes] = None
         self._content_hash: Optional[str] = None
-        self._status: Optional[FileStatus] = None
+        self._status = status
+
+    @property
+    def name(self) -> str:
+        return self.entry.name
 
-    @classmethod
-    def parse_obj(cls, data):
-        return cls(**data)
+    @property
+    def relative_path(self) -> str:
+        if self._relative_path is None:
+            self._relative_path = self.archive.index.relative_file(self.name)
+        return self._relative_path
+
+    @property
+    def path(self) -> Path:
+        return self.archive.index.directory.joinpath(self.name)
+
+    @property
+    def archive_index(self) -> int:
+        return self.entry.archive_index
+
+    @property
+    def offset(self) -> int:
+        return self.entry.offset
+
+    @property
+    def size(self) -> int:
+        return self.entry.size
+
+    @property
+    def hash(self) -> int:
+        return self.entry.hash
 
     @property
     def status(self):
@@ -39,63 +136,97 @@ class TroveFile:
 
     @property
     def color(self):
-        if self.status == FileStatus.unchanged:
-            return None
-        if self.status == FileStatus.added:
-            return "green"
-        if self.status == FileStatus.changed:
-            return "yellow"
-        if self.status == FileStatus.removed:
-            return "red"
+        return self.status.color if self.status is not None else None
 
     @property
     async def content_hash(self):
-        if self._content is None:
+        if self._content_hash is None:
             _ = await self.content
         return self._content_hash
 
     @property
     async def content(self):
         if self._content is None:
-            reader = BinaryReader(await self.archive.content)
-            reader.seek(self.offset)
-            self._content = reader.read_bytes(self.size)
-            self._content_hash = md5(self._content).hexdigest()
+            end = self.offset + self.size
+            content = await self.archive.content_until(end)
+            await memory.reserve("file", self.size, "read")
+            with metrics.measure("read", self.size):
+                self._content = bytes(content[self.offset : end])
+            memory.settle("file", self.size, len(self._content))
+            with metrics.measure("hash", self.size):
+                self._content_hash = md5(self._content).hexdigest()
         return self._content
 
-    def extracted_path(self, opath: Path, path: Path) -> Path:
-        return path.joinpath(self.path.relative_to(opath))
-
-    def extract_to_path(self, opath: Path, path: Path) -> Path:
-        return path.joinpath(self.path.relative_to(opath))
-
-    async def compare(self, opath: Path, path: Path) -> FileStatus:
-        extracted_file = self.extracted_path(opath, path)
-        if not extracted_file.exists():
-            self._status = FileStatus.added
-        else:
-            async with aiofiles.open(extracted_file, "rb") as f:
-                if await self.content_hash == md5(await f.read()).hexdigest():
-                    self._status = FileStatus.unchanged
-                else:
-                    self._status = FileStatus.changed
+    def extracted_path(self, path: Path) -> Path:
+        return path.joinpath(self.relative_path)
+
+    def extract_to_path(self, path: Path) -> Path:
+        return path.joinpath(self.relative_path)
+
+    async def compare(self, path: Path) -> FileStatus:
+        with metrics.measure("compare"):
+            extracted_file = self.extracted_path(path)
+            try:
+                old_size = extracted_file.stat().st_size
+            except FileNotFoundError:
+                self._status = FileStatus.added
+                return self.status
+            await memory.reserve("file", old_size, "read")
+            try:
+                with metrics.measure("read") as read:
+                    async with aiofiles.open(extracted_file, "rb") as f:
+                        old_content = await f.read()
+                    read.size = len(old_content)
+                with metrics.measure("hash", len(old_content)):
+                    old_hash = md5(old_content).hexdigest()
+                del old_content
+            finally:
+                memory.release("file", old_size)
+            if await self.content_hash == old_hash:
+                self._status = FileStatus.unchanged
+            else:
+                self._status = FileStatus.changed
+            # Only the hash is needed from now on, saving slices the payload again
+            self.release()
         return self.status
 
-    async def copy_old(self, opath: Path, gpath: Path, path: Path):
-        path_to_get = self.extract_to_path(opath, gpath)
-        if not path_to_get.exists():
+    async def copy_old(self, gpath: Path, path: Path):
+        path_to_get = self.extract_to_path(gpath)
+        try:
+            old_size = path_to_get.stat().st_size
+        except FileNotFoundError:
             return
-        path_to_save = self.extract_to_path(opath, path)
-        path_to_save.parent.mkdir(parents=True, exist_ok=True)
-        async with aiofiles.open(path_to_get, "rb") as old:
-            async with aiofiles.open(path_to_save, "wb") as new:
-                await new.write(await old.read())
+        path_to_save = self.extract_to_path(path)
+        with metrics.measure("mkdir"):
+            path_to_save.parent.mkdir(parents=True, exist_ok=True)
+        await memory.reserve("file", old_size, "read")
+        try:
+            with metrics.measure("read") as read:
+                async with aiofiles.open(path_to_get, "rb") as old:
+                    old_content = await old.read()
+                read.size = len(old_content)
+            with metrics.measure("write", len(old_content)):
+                async with aiofiles.open(path_to_save, "wb") as new:
+                    await new.write(old_content)
+        finally:
+            memory.release("file", old_size)
+
+    async def save(self, path: Path):
+        path_to_save = self.extract_to_path(path)
+        with metrics.measure("mkdir"):
+            path_to_save.parent.mkdir(parents=True, exist_ok=True)
+        content = await self.content
+        with metrics.measure("write", len(content)):
+            async with aiofiles.open(path_to_save, "wb") as f:
+                await f.write(content)
+
+    def release(self):
+        if self._content is not None:
+            memory.release("file", len(self._content))
+        self._content = None
 
-    async def save(self, opath: Path, path: Path):
-        path_to_save = self.extract_to_path(opath, path)
-        path_to_save.parent.mkdir(parents=True, exist_ok=True)
-        async with aiofiles.open(path_to_save, "wb") as f:
-            await f.write(await self.content)
+    def __del__(self):
+        self.release()
 
 
 class TFArchive:
@@ -103,9 +234,15 @@ class TFArchive:
         self.index = index
         self.directory = path.parent
         self.path = path
+        self.relative_path = index.relative_file(path.name)
         self.id = int(archive_id.search(path.stem).group(1))
+        self._compressed = MappedFile(path)
+        self._lock = asyncio.Lock()
+        self._inflater = None
+        self._inflated_from = 0
         self._content = None
         self._content_hash: Optional[str] = None
+        self._accounted = 0
 
     def __eq__(self, other):
         if not isinstance(other, TFIndex):
@@ -115,6 +252,9 @@ class TFArchive:
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __del__(self):
+        self.release()
+
     def __int__(self):
         return self.id
 
@@ -126,34 +266,131 @@ class TFArchive:
 
     @property
     async def content_hash(self):
-        if self._content is None:
-            _ = await self.content
+        if self._content_hash is None:
+            await asyncio.to_thread(self._hash)
         return self._content_hash
 
+    def _hash(self):
+        # A mapping of its own, the shared one is only closed by the inflate
+        with MappedFile(self.path) as compressed:
+            with metrics.measure("hash", len(compressed)):
+                self._content_hash = md5(compressed).hexdigest()
+
     @property
-    async def content(self):
-        if self._content is None:
-            data = zlib.decompressobj(wbits=zlib.MAX_WBITS)
-            async with aiofiles.open(self.path, "rb") as f:
-                self._content = data.decompress(await f.read())
-                self._content_hash = md5(self._content).hexdigest()
+    async def content(self) -> bytes:
+        return await self.content_until()
+
+    @property
+    async def expected_size(self) -> int:
+        """Inflated size up to the end of the last file listed in the index."""
+        return (await self.index.archive_totals).get(self.id, Totals()).end
+
+    async def content_until(self, end: Optional[int] = None) -> bytes:
+        """Inflates the archive at least up to end, or fully without one.
+
+        A hit in the inflate cache always loads the full payload, whatever
+        end is asked for."""
+        if end is not None and end >= await self.expected_size:
+            # Reading the last file finishes the inflate, so the archive is
+            # cached even when it is only ever read file by file
+            end = None
+        if self._content is not None:
+            if self._inflater is None or (
+                end is not None and len(self._content) >= end
+            ):
+                return self._content
+        async with self._lock:
+            if self._inflater is None:
+                if self._content is not None:
+                    return self._content
+                if self.index.cache is not None:
+                    content_hash = await self.content_hash
+                    reserved = await self.expected_size
+                    await memory.reserve("archive", reserved, "read")
+                    with metrics.measure("read") as read:
+                        self._content = await asyncio.to_thread(
+                            self.index.cache.get, content_hash
+                        )
+                        read.size = len(self._content or b"")
+                    self._accounted = memory.settle("archive", reserved, read.size)
+                    if self._content is not None:
+                        return self._content
+                # The whole archive is reserved upfront so partial inflates
+                # never wait on each other
+                reserved = await self.expected_size
+                await memory.reserve("archive", reserved, "inflate")
+                self._accounted = reserved
+                self._inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS)
+                self._inflated_from = 0
+                self._content = bytearray()
+            with metrics.measure("inflate", -len(self._content)) as inflate:
+                await asyncio.to_thread(self._inflate, end)
+                inflate.size += len(self._content)
+            if self._inflater is None:
+                self._accounted = memory.settle(
+                    "archive", self._accounted, len(self._content)
+                )
+            if self._inflater is None and self.index.cache is not None:
+                content_hash = await self.content_hash
+                with metrics.measure("write", len(self._content)):
+                    await asyncio.to_thread(
+                        self.index.cache.put, content_hash, self._content
+                    )
         return self._content
 
+    def _inflate(self, end: Optional[int]):
+        with tracer.span("inflate", "archive", archive=self.relative_path, end=end):
+            self._inflate_chunks(end)
+
+    def _inflate_chunks(self, end: Optional[int]):
+        compressed = self._compressed.open()
+        while end is None or len(self._content) < end:
+            if self._inflater.eof or self._inflated_from >= len(compressed):
+                self._content += self._inflater.flush()
+                self._inflater = None
+                self._compressed.close()
+                break
+            chunk = compressed[self._inflated_from : self._inflated_from + CHUNK_SIZE]
+            self._inflated_from += len(chunk)
+            self._content += self._inflater.decompress(chunk)
+
+    @property
+    def inflated_size(self) -> int:
+        return len(self._content) if self._content is not None else 0
+
+    def share_content(self, other: TFArchive):
+        # The accounting of the buffer moves along with it, so releasing the
+        # other archive first does not free a buffer still in use
+        self._content = other._content
+        self._content_hash = other._content_hash
+        self._accounted, other._accounted = self._accounted + other._accounted, 0
+
     async def files(self) -> Generator[TroveFile]:
-        for file in await self.index.files_list:
-            if file["archive_index"] == int(self):
-                copy_file = copy(file)
-                copy_file["archive"] = self
-                yield TroveFile.parse_obj(copy_file)
+        for entry in await self.index.files_list:
+            if entry.archive_index == self.id:
+                yield TroveFile(self, entry)
+
+    def release(self):
+        self._compressed.close()
+        self._inflater = None
+        self._content = None
+        memory.release("archive", self._accounted)
+        self._accounted = 0
 
 
 class TFIndex:
-    def __init__(self, file: Path):
+    def __init__(self, file: Path, root: Path, cache: Optional[InflateCache] = None):
         self.directory = file.parent
         self.path = file
+        self.relative_directory = sys.intern(str(self.directory.relative_to(root)))
+        self.relative_path = self.relative_file(file.name)
+        self.cache = cache
         self._files = []
-        self._content = None
+        self._parsed = False
+        self._totals = Totals()
+        self._archive_totals: dict[int, Totals] = {}
         self._content_hash: Optional[str] = None
+        self._accounted = 0
 
     def __eq__(self, other):
         if not isinstance(other, TFIndex):
@@ -163,6 +400,9 @@ class TFIndex:
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __del__(self):
+        memory.release("index", self._accounted)
+
     def __str__(self):
         return f"<path={str(self.path)}>"
 
@@ -171,17 +411,14 @@ class TFIndex:
 
     @property
     async def content_hash(self):
-        if self._content is None:
-            _ = await self.content
+        if self._content_hash is None:
+            with MappedFile(self.path) as buffer:
+                with metrics.measure("hash", len(buffer)):
+                    self._content_hash = md5(buffer).hexdigest()
         return self._content_hash
 
-    @property
-    async def content(self):
-        if self._content is None:
-            async with aiofiles.open(self.path, "rb") as f:
-                self._content = await f.read()
-            self._content_hash = md5(self._content).hexdigest()
-        return self._content
+    def relative_file(self, name: str) -> str:
+        return self.relative_directory + os.sep + name.replace("/", os.sep)
 
     @property
     def archives(self) -> Generator[TFArchive]:
@@ -189,60 +426,72 @@ class TFIndex:
             yield TFArchive(self, archive)
 
     @property
-    async def files_list(self) -> list[dict]:
-        if not self._files:
-            self._files.extend([x async for x in self.get_files_list()])
+    async def files_list(self) -> list[TFIEntry]:
+        if not self._parsed:
+            files = [x async for x in self.get_files_list()]
+            accounted = sys.getsizeof(files) + sum(
+                sys.getsizeof(entry) for entry in files
+            )
+            # Nothing is kept when over budget, so a later access parses again
+            memory.acquire("index", accounted, "parse")
+            self._accounted = accounted
+            self._files = files
+            for entry in self._files:
+                self._totals.add(entry)
+                if entry.archive_index not in self._archive_totals:
+                    self._archive_totals[entry.archive_index] = Totals()
+                self._archive_totals[entry.archive_index].add(entry)
+            self._parsed = True
         return self._files
 
-    async def get_files_list(self) -> Generator[dict]:
-        reader = BinaryReader(await self.content)
-        while reader.pos() < reader.size():
-            file = dict()
-            file["name"] = reader.read_str(ReadVarInt7Bit(reader, reader.pos()))
-            file["path"] = self.directory.joinpath(file["name"])
-            file["archive_index"] = ReadVarInt7Bit(reader, reader.pos())
-            file["offset"] = ReadVarInt7Bit(reader, reader.pos())
-            file["size"] = ReadVarInt7Bit(reader, reader.pos())
-            file["hash"] = ReadVarInt7Bit(reader, reader.pos())
-            yield file
+    @property
+    async def totals(self) -> Totals:
+        await self.files_list
+        return self._totals
+
+    @property
+    async def archive_totals(self) -> dict[int, Totals]:
+        await self.files_list
+        return self._archive_totals
+
+    async def get_files_list(self) -> Generator[TFIEntry]:
+        with MappedFile(self.path) as buffer:
+            if self._content_hash is None:
+                with metrics.measure("hash", len(buffer)):
+                    self._content_hash = md5(buffer).hexdigest()
+            with metrics.measure("parse", len(buffer)), tracer.span(
+                "parse", "index", index=self.relative_path
+            ):
+                entries = parse_index(buffer)
+        for entry in entries:
+            yield entry
 
 
 async def find_all_indexes(
-    path: Path, hashes: dict, track_changes=True
+    path: Path,
+    hashes: dict,
+    track_changes=True,
+    walker: Optional[DirectoryWalker] = None,
+    cache: Optional[InflateCache] = None,
 ) -> Generator[TFIndex]:
-    known_directories = [
-        "audio",
-        "blueprints",
-        "fonts",
-        "languages",
-        "models",
-        "movies",
-        "particles",
-        "prefabs",
-        "shadersunified",
-        "textures",
-        "ui",
-    ]
-    for item in path.iterdir():
-        if item.is_file():
-            continue
-        if item.name not in known_directories:
+    if walker is None:
+        walker = DirectoryWalker("index.tfi")
+    with metrics.measure("discovery"), tracer.span("discovery", "index"):
+        index_files = await walker.find(path, known_directories)
+    for index_file in index_files:
+        index = TFIndex(index_file, path, cache)
+        if not track_changes:
+            yield index
             continue
-        for index_file in item.rglob("index.tfi"):
-            index = TFIndex(index_file)
-            if not track_changes:
-                yield index
-                continue
-            hash = hashes.get(str(index.path.relative_to(path)))
-            if hash is None or await index.content_hash != hash:
-                yield index
+        hash = hashes.get(index.relative_path)
+        if hash is None or await index.content_hash != hash:
+            yield index
 
 
 async def find_all_archives(path: Path, hashes: dict) -> Generator[TFArchive]:
     async for index in find_all_indexes(path, hashes):
         for archive in index.archives:
-            opath = archive.path.relative_to(path)
-            hash = hashes.get(opath)
+            hash = hashes.get(archive.relative_path)
             if hash is None or (await archive.content_hash) != hash:
                 yield archive
 
@@ -257,26 +506,52 @@ async def find_changes(
     archive_path: Path, extracted_path: Path, hashes: dict
 ) -> Generator[TroveFile]:
     async for file in find_all_files(archive_path, hashes):
-        if (await file.compare(archive_path, extracted_path)) in [
+        if (await file.compare(extracted_path)) in [
             FileStatus.added,
             FileStatus.changed,
         ]:
             yield file
 
 
-def ReadVarInt7Bit(buffer: BinaryReader, pos):
+def inflate(path: Path, end: Optional[int] = None) -> bytearray:
+    inflater = zlib.decompressobj(wbits=zlib.MAX_WBITS)
+    content = bytearray()
+    with MappedFile(path) as compressed:
+        position = 0
+        while end is None or len(content) < end:
+            if inflater.eof or position >= len(compressed):
+                content += inflater.flush()
+                break
+            content += inflater.decompress(compressed[position : position + CHUNK_SIZE])
+            position += CHUNK_SIZE
+    return content
+
+
+def parse_index(buffer) -> list[TFIEntry]:
+    entries = []
+    pos, end = 0, len(buffer)
+    while pos < end:
+        length, pos = ReadVarInt7Bit(buffer, pos)
+        name = buffer[pos : pos + length].split(b"\x00", 1)[0].decode("utf-8")
+        pos += length
+        archive_index, pos = ReadVarInt7Bit(buffer, pos)
+        offset, pos = ReadVarInt7Bit(buffer, pos)
+        size, pos = ReadVarInt7Bit(buffer, pos)
+        hash, pos = ReadVarInt7Bit(buffer, pos)
+        entries.append(TFIEntry(sys.intern(name), archive_index, offset, size, hash))
+    return entries
+
+
+def ReadVarInt7Bit(buffer, pos: int) -> tuple[int, int]:
     result = 0
     shift = 0
     while 1:
-        buffer.seek(pos)
-        b = buffer.read_bytes()
-        for i, byte in enumerate(b):
-            result |= (byte & 0x7F) << shift
-            pos += 1
-            if not (byte & 0x80):
-                result &= (1 << 32) - 1
-                result = int(result)
-                return result
-            shift += 7
-            if shift >= 64:
-                raise Exception("Too many bytes when decoding varint.")
+        byte = buffer[pos]
+        result |= (byte & 0x7F) << shift
+        pos += 1
+        if not (byte & 0x80):
+            result &= (1 << 32) - 1
+            return result, pos
+        shift += 7
+        if shift >= 64:
+            raise Exception("Too many bytes when decoding varint.")
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import re
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path, PurePath
+from typing import NamedTuple, Optional, Union
+
+from utils.cache import InflateCache
+from utils.extractor import TFArchive, TFIEntry, TroveFile, find_all_indexes
+
+PathLike = Union[str, PurePath]
+
+
+class TroveStat(NamedTuple):
+    path: str
+    is_dir: bool
+    size: int = 0
+    hash: Optional[int] = None
+    archive: Optional[str] = None
+    offset: Optional[int] = None
+
+
+glob_tokens = re.compile(r"(\*\*/|\*\*|\*|\?|\[[^\]]*\])")
+
+
+def compile_glob(pattern: str) -> re.Pattern:
+    """Compiles a glob where * and ? stay within a directory and ** spans any."""
+    regex = []
+    for token in glob_tokens.split(pattern):
+        if token == "**/":
+            regex.append("(?:.*/)?")
+        elif token == "**":
+            regex.append(".*")
+        elif token == "*":
+            regex.append("[^/]*")
+        elif token == "?":
+            regex.append("[^/]")
+        elif token.startswith("[") and token.endswith("]") and len(token) > 2:
+            regex.append("[^" + token[2:] if token[1] == "!" else token)
+        else:
+            regex.append(re.escape(token))
+    return re.compile("".join(regex) + r"\Z")
+
+
+def normalize(path: PathLike) -> str:
+    if isinstance(path, PurePath):
+        path = path.as_posix()
+    return "/".join(p for p in path.replace("\\", "/").split("/") if p not in ("", "."))
+
+
+class TroveFS:
+    """Read-only view of an install's files, read straight from its archives.
+
+    Paths are relative to the install root and use forward slashes. Inflated
+    archives are kept in memory up to max_memory bytes, the least recently used
+    ones being released first."""
+
+    def __init__(
+        self,
+        root: Path,
+        cache: Optional[InflateCache] = None,
+        max_memory: int = 256 * 1024**2,
+    ):
+        self.root = root
+        self.cache = cache
+        self.max_memory = max_memory
+        self._files: dict[str, tuple[TFArchive, TFIEntry]] = {}
+        self._directories: dict[str, set[str]] = {"": set()}
+        self._archives: OrderedDict[str, TFArchive] = OrderedDict()
+
+    @classmethod
+    async def mount(cls, root: Path, **kwargs) -> TroveFS:
+        fs = cls(root, **kwargs)
+        await fs.load()
+        return fs
+
+    async def load(self):
+        self._files.clear()
+        self._directories = {"": set()}
+        async for index in find_all_indexes(self.root, {}, False, cache=self.cache):
+            directory = normalize(index.relative_directory)
+            self._add_directory(directory)
+            archives = {archive.id: archive for archive in index.archives}
+            for entry in await index.files_list:
+                archive = archives.get(entry.archive_index)
+                if archive is None:
+                    continue
+                path = normalize(f"{directory}/{entry.name}")
+                parent, _, name = path.rpartition("/")
+                self._add_directory(parent)
+                self._directories[parent].add(name)
+                self._files[path] = (archive, entry)
+
+    def _add_directory(self, directory: str):
+        if directory in self._directories:
+            return
+        parent, _, name = directory.rpartition("/")
+        self._add_directory(parent)
+        self._directories[parent].add(name)
+        self._directories[directory] = set()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, path: PathLike):
+        return self.exists(path)
+
+    def exists(self, path: PathLike) -> bool:
+        path = normalize(path)
+        return path in self._files or path in self._directories
+
+    def isfile(self, path: PathLike) -> bool:
+        return normalize(path) in self._files
+
+    def isdir(self, path: PathLike) -> bool:
+        return normalize(path) in self._directories
+
+    def listdir(self, path: PathLike = "") -> list[str]:
+        children = self._directories.get(normalize(path))
+        if children is None:
+            raise FileNotFoundError(f"No such directory: {path}")
+        return sorted(children)
+
+    def stat(self, path: PathLike) -> TroveStat:
+        path = normalize(path)
+        if path in self._directories:
+            return TroveStat(path, True)
+        try:
+            archive, entry = self._files[path]
+        except KeyError:
+            raise FileNotFoundError(f"No such file: {path}")
+        return TroveStat(
+            path, False, entry.size, entry.hash, archive.relative_path, entry.offset
+        )
+
+    def glob(self, pattern: str) -> list[str]:
+        pattern = compile_glob(normalize(pattern))
+        return sorted(path for path in self._files if pattern.match(path))
+
+    def _file(self, path: PathLike) -> TroveFile:
+        try:
+            archive, entry = self._files[normalize(path)]
+        except KeyError:
+            raise FileNotFoundError(f"No such file: {path}")
+        return TroveFile(archive, entry)
+
+    async def read(self, path: PathLike) -> bytes:
+        file = self._file(path)
+        content = await file.content
+        self._archives[file.archive.relative_path] = file.archive
+        self._archives.move_to_end(file.archive.relative_path)
+        self._evict()
+        return content
+
+    async def open(self, path: PathLike) -> BytesIO:
+        return BytesIO(await self.read(path))
+
+    def _evict(self):
+        memory = sum(archive.inflated_size for archive in self._archives.values())
+        while memory > self.max_memory and len(self._archives) > 1:
+            _, archive = self._archives.popitem(last=False)
+            memory -= archive.inflated_size
+            archive.release()
+
+    def release(self):
+        for archive in self._archives.values():
+            archive.release()
+        self._archives.clear()
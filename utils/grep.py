@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncGenerator, Iterable, NamedTuple, Optional
+
+from utils.extractor import TroveFile, inflate
+from utils.planner import ExtractionPlan
+
+
+class GrepMatch(NamedTuple):
+    path: str
+    offset: int
+
+
+def grep_archive(
+    path: Path,
+    files: list[tuple[str, int, int]],
+    pattern: bytes,
+    regex: bool,
+    ignore_case: bool,
+) -> list[tuple[str, int]]:
+    content = inflate(path, max(offset + size for _, offset, size in files))
+    view = memoryview(content)
+    expression = None
+    if regex or ignore_case:
+        expression = re.compile(
+            pattern if regex else re.escape(pattern),
+            re.IGNORECASE if ignore_case else 0,
+        )
+    matches = []
+    for relative_path, offset, size in files:
+        if expression is not None:
+            for match in expression.finditer(view[offset : offset + size]):
+                matches.append((relative_path, match.start()))
+            continue
+        end = offset + size
+        position = content.find(pattern, offset, end)
+        while position != -1:
+            matches.append((relative_path, position - offset))
+            position = content.find(pattern, position + 1, end)
+    view.release()
+    return matches
+
+
+class ContentGrep:
+    """Searches file payloads for a bytes or regex pattern without extracting.
+
+    Archives are inflated and scanned by a pool of processes. An archive is only
+    handed to a worker once the bytes it inflates fit in the memory budget next
+    to the archives already in flight."""
+
+    def __init__(
+        self,
+        pattern: bytes,
+        regex: bool = False,
+        ignore_case: bool = False,
+        workers: Optional[int] = None,
+        memory_budget: int = 1024**3,
+    ):
+        self.pattern = pattern
+        self.regex = regex
+        self.ignore_case = ignore_case
+        self.workers = workers or os.cpu_count() or 1
+        self.memory_budget = memory_budget
+        self._reserved = 0
+        self._budget = asyncio.Condition()
+
+    async def _reserve(self, size: int):
+        async with self._budget:
+            # Archives larger than the whole budget are scanned on their own
+            await self._budget.wait_for(
+                lambda: self._reserved == 0
+                or self._reserved + size <= self.memory_budget
+            )
+            self._reserved += size
+
+    async def _free(self, size: int):
+        async with self._budget:
+            self._reserved -= size
+            self._budget.notify_all()
+
+    async def search(self, files: Iterable[TroveFile]) -> AsyncGenerator[GrepMatch]:
+        loop = asyncio.get_running_loop()
+        workers = asyncio.Semaphore(self.workers)
+        with ProcessPoolExecutor(self.workers) as pool:
+
+            async def scan(archive_plan):
+                async with workers:
+                    await self._reserve(archive_plan.end)
+                    try:
+                        return await loop.run_in_executor(
+                            pool,
+                            grep_archive,
+                            archive_plan.archive.path,
+                            [
+                                (
+                                    file.relative_path.replace(os.sep, "/"),
+                                    file.offset,
+                                    file.size,
+                                )
+                                for file in archive_plan.files
+                            ],
+                            self.pattern,
+                            self.regex,
+                            self.ignore_case,
+                        )
+                    finally:
+                        await self._free(archive_plan.end)
+
+            for task in asyncio.as_completed(
+                [scan(archive_plan) for archive_plan in ExtractionPlan(files)]
+            ):
+                for path, offset in await task:
+                    yield GrepMatch(path, offset)
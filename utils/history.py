@@ -0,0 +1,269 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from datetime import datetime
+from enum import Enum
+from hashlib import md5
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+
+class HistoryStatus(Enum):
+    added = "Added"
+    changed = "Changed"
+    removed = "Removed"
+
+
+class Snapshot(NamedTuple):
+    id: int
+    source: str
+    created: datetime
+
+
+class HistoryEntry(NamedTuple):
+    path: str
+    status: HistoryStatus
+    old_size: Optional[int]
+    old_hash: Optional[int]
+    new_size: Optional[int]
+    new_hash: Optional[int]
+
+
+async def index_entries(indexes) -> tuple[Iterator[tuple[str, int, int]], str]:
+    """Returns the (path, size, hash) entries of the given indexes along with a
+    fingerprint of their hashes, entries are only built once iterated."""
+    fingerprint = md5()
+    files = []
+    for index in sorted(indexes, key=lambda index: index.relative_path):
+        fingerprint.update(
+            f"{index.relative_path}:{await index.content_hash}\n".encode()
+        )
+        directory = index.relative_directory.replace(os.sep, "/") + "/"
+        files.append((directory, await index.files_list))
+    entries = (
+        (directory + file.name, file.size, file.hash)
+        for directory, files_list in files
+        for file in files_list
+    )
+    return entries, fingerprint.hexdigest()
+
+
+class PatchHistory:
+    """Versioned catalog snapshots stored as deltas in a sqlite database.
+
+    Each snapshot only stores the rows that differ from the previous snapshot of
+    the same source, a removed file is stored as a row with no size and hash."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY,
+                source_id INTEGER NOT NULL,
+                created TEXT NOT NULL,
+                fingerprint TEXT
+            );
+            CREATE TABLE IF NOT EXISTS paths (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS versions (
+                source_id INTEGER NOT NULL,
+                path_id INTEGER NOT NULL,
+                snapshot_id INTEGER NOT NULL,
+                size INTEGER,
+                hash INTEGER,
+                PRIMARY KEY (source_id, path_id, snapshot_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS versions_snapshot
+                ON versions (source_id, snapshot_id);
+            CREATE TABLE IF NOT EXISTS latest (
+                source_id INTEGER NOT NULL,
+                path_id INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                hash INTEGER NOT NULL,
+                PRIMARY KEY (source_id, path_id)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def _source_id(self, source: str, create=False) -> Optional[int]:
+        row = self.connection.execute(
+            "SELECT id FROM sources WHERE path = ?", (source,)
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        if not create:
+            return None
+        return self.connection.execute(
+            "INSERT INTO sources (path) VALUES (?)", (source,)
+        ).lastrowid
+
+    def _path_ids(self, paths: Iterable[str]) -> dict[str, int]:
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO paths (path) VALUES (?)", ((p,) for p in paths)
+        )
+        return dict(self.connection.execute("SELECT path, id FROM paths"))
+
+    def last_fingerprint(self, source: str) -> Optional[str]:
+        """Returns the fingerprint of the latest snapshot of a source."""
+        row = self.connection.execute(
+            "SELECT snapshots.fingerprint FROM snapshots"
+            " JOIN sources ON sources.id = snapshots.source_id"
+            " WHERE sources.path = ? ORDER BY snapshots.id DESC LIMIT 1",
+            (source,),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def record(
+        self,
+        source: str,
+        entries: Iterable[tuple[str, int, int]],
+        fingerprint: Optional[str] = None,
+    ) -> Optional[Snapshot]:
+        """Records a snapshot of (path, size, hash) entries for a source.
+
+        When a fingerprint is given and matches the one of the latest snapshot,
+        nothing is recorded and the entries are never read."""
+        if fingerprint is not None and fingerprint == self.last_fingerprint(source):
+            return None
+        entries = {path: (size, hash) for path, size, hash in entries}
+        created = datetime.now()
+        with self.connection:
+            source_id = self._source_id(source, create=True)
+            path_ids = self._path_ids(entries)
+            snapshot_id = self.connection.execute(
+                "INSERT INTO snapshots (source_id, created, fingerprint)"
+                " VALUES (?, ?, ?)",
+                (source_id, created.isoformat(), fingerprint),
+            ).lastrowid
+            latest = {
+                path_id: (size, hash)
+                for path_id, size, hash in self.connection.execute(
+                    "SELECT path_id, size, hash FROM latest WHERE source_id = ?",
+                    (source_id,),
+                )
+            }
+            changed = []
+            for path, state in entries.items():
+                path_id = path_ids[path]
+                if latest.pop(path_id, None) != state:
+                    changed.append((source_id, path_id, snapshot_id, *state))
+            removed = [
+                (source_id, path_id, snapshot_id, None, None) for path_id in latest
+            ]
+            self.connection.executemany(
+                "INSERT INTO versions VALUES (?, ?, ?, ?, ?)", changed + removed
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?)",
+                (row[:2] + row[3:] for row in changed),
+            )
+            self.connection.executemany(
+                "DELETE FROM latest WHERE source_id = ? AND path_id = ?",
+                (row[:2] for row in removed),
+            )
+        return Snapshot(snapshot_id, source, created)
+
+    def _snapshot(self, row) -> Snapshot:
+        return Snapshot(row[0], row[1], datetime.fromisoformat(row[2]))
+
+    def snapshots(self, source: Optional[str] = None) -> list[Snapshot]:
+        query = (
+            "SELECT snapshots.id, sources.path, snapshots.created FROM snapshots"
+            " JOIN sources ON sources.id = snapshots.source_id"
+        )
+        if source is None:
+            rows = self.connection.execute(query + " ORDER BY snapshots.id")
+        else:
+            rows = self.connection.execute(
+                query + " WHERE sources.path = ? ORDER BY snapshots.id", (source,)
+            )
+        return [self._snapshot(row) for row in rows]
+
+    def get_snapshot(self, snapshot_id: int) -> Optional[Snapshot]:
+        row = self.connection.execute(
+            "SELECT snapshots.id, sources.path, snapshots.created FROM snapshots"
+            " JOIN sources ON sources.id = snapshots.source_id"
+            " WHERE snapshots.id = ?",
+            (snapshot_id,),
+        ).fetchone()
+        return self._snapshot(row) if row is not None else None
+
+    def last_changed(self, source: str, path: str) -> Optional[Snapshot]:
+        """Returns the latest snapshot in which the given file changed."""
+        row = self.connection.execute(
+            "SELECT snapshots.id, sources.path, snapshots.created FROM versions"
+            " JOIN sources ON sources.id = versions.source_id"
+            " JOIN paths ON paths.id = versions.path_id"
+            " JOIN snapshots ON snapshots.id = versions.snapshot_id"
+            " WHERE sources.path = ? AND paths.path = ?"
+            " ORDER BY versions.snapshot_id DESC LIMIT 1",
+            (source, path),
+        ).fetchone()
+        return self._snapshot(row) if row is not None else None
+
+    def changes(self, old: int, new: int) -> list[HistoryEntry]:
+        """Lists every file that differs between two snapshots of a source."""
+        old_snapshot, new_snapshot = self.get_snapshot(old), self.get_snapshot(new)
+        if old_snapshot is None or new_snapshot is None:
+            raise ValueError("Unknown snapshot.")
+        if old_snapshot.source != new_snapshot.source:
+            raise ValueError("Snapshots belong to different sources.")
+        if old > new:
+            old, new = new, old
+        source_id = self._source_id(new_snapshot.source)
+        rows = self.connection.execute(
+            """
+            WITH touched AS (
+                SELECT DISTINCT path_id FROM versions
+                WHERE source_id = :source AND snapshot_id > :old
+                AND snapshot_id <= :new
+            )
+            SELECT paths.path, o.size, o.hash, n.size, n.hash FROM touched
+            JOIN paths ON paths.id = touched.path_id
+            LEFT JOIN versions o ON o.source_id = :source
+                AND o.path_id = touched.path_id
+                AND o.snapshot_id = (
+                    SELECT MAX(snapshot_id) FROM versions
+                    WHERE source_id = :source AND path_id = touched.path_id
+                    AND snapshot_id <= :old
+                )
+            JOIN versions n ON n.source_id = :source
+                AND n.path_id = touched.path_id
+                AND n.snapshot_id = (
+                    SELECT MAX(snapshot_id) FROM versions
+                    WHERE source_id = :source AND path_id = touched.path_id
+                    AND snapshot_id <= :new
+                )
+            ORDER BY paths.path
+            """,
+            {"source": source_id, "old": old, "new": new},
+        )
+        changes = []
+        for path, old_size, old_hash, new_size, new_hash in rows:
+            if old_size is None and new_size is None:
+                continue
+            if old_size is None:
+                status = HistoryStatus.added
+            elif new_size is None:
+                status = HistoryStatus.removed
+            elif (old_size, old_hash) != (new_size, new_hash):
+                status = HistoryStatus.changed
+            else:
+                continue
+            changes.append(
+                HistoryEntry(path, status, old_size, old_hash, new_size, new_hash)
+            )
+        return changes
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import mmap
+import os
+from pathlib import Path
+from typing import Optional, Union
+
+
+class MappedFile:
+    """Read-only memory mapping of a file, empty files map to an empty bytes."""
+
+    __slots__ = ("path", "_file", "buffer")
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+        self.buffer: Optional[Union[mmap.mmap, bytes]] = None
+
+    def __enter__(self) -> Union[mmap.mmap, bytes]:
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self) -> Union[mmap.mmap, bytes]:
+        if self.buffer is None:
+            self._file = open(self.path, "rb")
+            if os.fstat(self._file.fileno()).st_size:
+                self.buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.buffer = b""
+        return self.buffer
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self.buffer = None
@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+from enum import Enum
+from typing import Optional
+
+from utils.metrics import current_stage
+
+kinds = ("archive", "file", "index")
+
+
+class BudgetAction(Enum):
+    abort = "Abort"
+    throttle = "Throttle"
+
+
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    def _process_memory() -> tuple[int, int]:
+        """Returns the current and peak working set of the process."""
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(),
+            ctypes.byref(counters),
+            counters.cb,
+        )
+        return counters.WorkingSetSize, counters.PeakWorkingSetSize
+
+else:
+    import resource
+
+    def _process_memory() -> tuple[int, int]:
+        """Returns the current and peak resident set size of the process."""
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports the peak in kilobytes, macOS in bytes
+        if sys.platform != "darwin":
+            peak *= 1024
+        try:
+            with open("/proc/self/statm") as f:
+                current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            current = peak
+        return current, max(current, peak)
+
+
+class MemoryGovernor:
+    """Live bytes held in archive, file and index buffers.
+
+    Producers reserve the bytes of a buffer before creating it and release them
+    once it is written, compared or dropped. With a budget, reservations that do
+    not fit either abort the run or wait for other buffers to be released, for as
+    long as it takes unless a timeout is set.
+
+    File payloads get their own share of the budget, they are only held while
+    being compared or written and never wait for anything else meanwhile, so an
+    archive waiting for its files can not block another one. A reservation is
+    always granted when nothing else is held in its share, so a single large
+    archive or file still goes through.
+
+    Peaks are kept per kind of buffer and per pipeline stage holding them when
+    they grew, along with the resident set size when a stage reached its peak."""
+
+    def __init__(self):
+        self.live = dict.fromkeys(kinds, 0)
+        self.peak = dict.fromkeys(kinds, 0)
+        self.peak_total = 0
+        self.stages: dict[str, int] = {}
+        self.stages_rss: dict[str, int] = {}
+        self.budget: Optional[int] = None
+        self.action = BudgetAction.abort
+        self.timeout: Optional[float] = None
+        self.file_share = 0.25
+        self.waits = 0
+        self._released: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def reset(self):
+        self.peak = dict(self.live)
+        self.peak_total = self.total
+        self.stages.clear()
+        self.stages_rss.clear()
+        self.waits = 0
+
+    def configure(
+        self,
+        budget: Optional[int],
+        action: BudgetAction = BudgetAction.abort,
+        timeout: Optional[float] = None,
+    ):
+        self.budget = budget
+        self.action = action
+        self.timeout = timeout
+
+    @property
+    def total(self) -> int:
+        return sum(self.live.values())
+
+    def fits(self, kind: str, size: int) -> bool:
+        if self.budget is None:
+            return True
+        file_budget = self.budget * self.file_share
+        if kind == "file":
+            held = self.live["file"]
+            return not held or held + size <= file_budget
+        held = self.live["archive"] + self.live["index"]
+        return not self.live["archive"] or held + size <= self.budget - file_budget
+
+    def _account(self, kind: str, size: int, stage: Optional[str] = None) -> str:
+        self.live[kind] += size
+        self.peak[kind] = max(self.peak[kind], self.live[kind])
+        total = self.total
+        self.peak_total = max(self.peak_total, total)
+        stage = stage or current_stage.get() or "other"
+        if total > self.stages.get(stage, 0):
+            self.stages[stage] = total
+            self.stages_rss[stage] = max(
+                self.stages_rss.get(stage, 0), _process_memory()[0]
+            )
+        return stage
+
+    def acquire(self, kind: str, size: int, stage: Optional[str] = None):
+        """Accounts for a buffer without waiting for room in the budget."""
+        if not size:
+            return
+        stage = self._account(kind, size, stage)
+        total = self.total
+        if (
+            self.budget is not None
+            and self.action == BudgetAction.abort
+            and total - size
+            and total > self.budget
+        ):
+            self.release(kind, size)
+            raise MemoryBudgetExceeded(
+                f"{total} bytes held in buffers during {stage}, "
+                f"over the budget of {self.budget} bytes."
+            )
+
+    async def reserve(self, kind: str, size: int, stage: Optional[str] = None):
+        """Accounts for a buffer about to be created, waiting for room in the
+        budget first when throttling."""
+        if (
+            size > 0
+            and self.action == BudgetAction.throttle
+            and not self.fits(kind, size)
+        ):
+            await self._wait(kind, size)
+        self.acquire(kind, size, stage)
+
+    def settle(self, kind: str, reserved: int, size: int) -> int:
+        """Corrects a reservation to the actual size of the buffer created."""
+        if size > reserved:
+            self._account(kind, size - reserved)
+        elif size < reserved:
+            self.release(kind, reserved - size)
+        return size
+
+    def release(self, kind: str, size: int):
+        if not size:
+            return
+        self.live[kind] -= size
+        if self._released is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._released.set)
+            except RuntimeError:
+                self._released = None
+
+    async def _wait(self, kind: str, size: int):
+        loop = asyncio.get_running_loop()
+        if self._released is None or self._loop is not loop:
+            self._released = asyncio.Event()
+            self._loop = loop
+        self.waits += 1
+        deadline = loop.time() + self.timeout if self.timeout is not None else None
+        while not self.fits(kind, size):
+            self._released.clear()
+            try:
+                await asyncio.wait_for(
+                    self._released.wait(),
+                    max(deadline - loop.time(), 0) if deadline is not None else None,
+                )
+            except asyncio.TimeoutError:
+                raise MemoryBudgetExceeded(
+                    f"{self.total} bytes still held in buffers after "
+                    f"{self.timeout}s, over the budget of {self.budget} bytes."
+                )
+
+    def report(self) -> dict:
+        current, peak = _process_memory()
+        return {
+            "Peak RSS": peak,
+            "Current RSS": current,
+            "Peak buffers": self.peak_total,
+            "Budget": self.budget,
+            "Waits": self.waits,
+            "Buffers": {
+                kind.capitalize(): {"Live": self.live[kind], "Peak": self.peak[kind]}
+                for kind in kinds
+            },
+            "Stages": {
+                stage.capitalize(): {
+                    "Peak buffers": size,
+                    "Peak RSS": self.stages_rss.get(stage),
+                }
+                for stage, size in self.stages.items()
+            },
+        }
+
+
+memory = MemoryGovernor()
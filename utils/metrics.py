@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+stages = (
+    "discovery",
+    "parse",
+    "read",
+    "inflate",
+    "hash",
+    "compare",
+    "mkdir",
+    "write",
+)
+_parent: ContextVar[Optional[list[float]]] = ContextVar("parent", default=None)
+current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+
+class StageMetrics:
+    __slots__ = ("count", "bytes", "time")
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.time = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return self.bytes / self.time if self.time else 0.0
+
+
+class Span:
+    __slots__ = ("size",)
+
+    def __init__(self, size: int = 0):
+        self.size = size
+
+
+class Metrics:
+    """Count, bytes and time accumulated per stage of the extraction pipeline.
+
+    Time spent in a stage measured inside another one is only counted for the
+    inner stage. Stages running concurrently are each timed in full, so the
+    times of every stage can add up to more than the wall time of the run.
+    Stages are also measured from worker threads, so updates hold a lock."""
+
+    def __init__(self):
+        self.stages = {stage: StageMetrics() for stage in stages}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            for stage in self.stages.values():
+                stage.__init__()
+
+    def add(self, stage: str, seconds: float, size: int = 0, count: int = 1):
+        with self._lock:
+            metrics = self.stages[stage]
+            metrics.count += count
+            metrics.bytes += size
+            metrics.time += seconds
+
+    @contextmanager
+    def measure(self, stage: str, size: int = 0):
+        parent = _parent.get()
+        children = [0.0]
+        token = _parent.set(children)
+        stage_token = current_stage.set(stage)
+        span = Span(size)
+        start = perf_counter()
+        try:
+            yield span
+        finally:
+            elapsed = perf_counter() - start
+            _parent.reset(token)
+            current_stage.reset(stage_token)
+            self.add(stage, elapsed - children[0], span.size)
+            if parent is not None:
+                with self._lock:
+                    parent[0] += elapsed
+
+    @property
+    def total(self) -> float:
+        return sum(stage.time for stage in self.stages.values())
+
+    def report(self) -> dict:
+        return {
+            name.capitalize(): {
+                "Count": stage.count,
+                "Bytes": stage.bytes,
+                "Seconds": round(stage.time, 3),
+                "MB/s": round(stage.throughput / 1024**2, 2),
+            }
+            for name, stage in self.stages.items()
+            if stage.count
+        }
+
+
+metrics = Metrics()
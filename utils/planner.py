@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from typing import Iterable, Iterator
+
+from utils.extractor import TFArchive, TroveFile
+
+
+class ArchivePlan:
+    __slots__ = ("archive", "files")
+
+    def __init__(self, archive: TFArchive, files: list[TroveFile]):
+        self.archive = archive
+        self.files = sorted(files, key=lambda f: f.offset)
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def end(self) -> int:
+        return max((f.offset + f.size for f in self.files), default=0)
+
+    @property
+    def size(self) -> int:
+        return sum(f.size for f in self.files)
+
+    @property
+    def writes(self) -> list[TroveFile]:
+        return sorted(self.files, key=lambda f: f.relative_path)
+
+
+class ExtractionPlan:
+    """Groups files by the archive holding them.
+
+    Archives are visited in path order, files inside an archive are read in
+    offset order and written in destination order."""
+
+    def __init__(self, files: Iterable[TroveFile]):
+        groups: dict[str, tuple[TFArchive, list[TroveFile]]] = {}
+        for file in files:
+            group = groups.setdefault(file.archive.relative_path, (file.archive, []))
+            group[1].append(file)
+        self.archives = [
+            ArchivePlan(archive, archive_files)
+            for _, (archive, archive_files) in sorted(groups.items())
+        ]
+
+    def __iter__(self) -> Iterator[ArchivePlan]:
+        return iter(self.archives)
+
+    def __len__(self):
+        return sum(len(archive) for archive in self.archives)
+
+    @property
+    def size(self) -> int:
+        return sum(archive.size for archive in self.archives)
+
+    @property
+    def files(self) -> list[TroveFile]:
+        return [file for archive in self.archives for file in archive.files]
+
+    @property
+    def writes(self) -> list[TroveFile]:
+        return sorted(self.files, key=lambda f: f.relative_path)
@@ -6,6 +6,8 @@ from typing import Optional
 from flet import ThemeMode
 from pydantic import BaseModel, Field
 
+from utils.memory import BudgetAction
+
 
 class AccentColor(Enum):
     blue = "BLUE"
@@ -45,6 +47,11 @@ class Preferences(BaseModel):
     accent_color: AccentColor = AccentColor.amber
     advanced_mode: bool = False
     performance_mode: bool = False
+    inflate_cache: bool = False
+    inflate_cache_size: int = 4 * 1024**3
+    trace: bool = False
+    memory_budget: Optional[int] = None
+    memory_budget_action: BudgetAction = BudgetAction.abort
     changes_name_format: str = "%Y-%m-%d %H-%M-%S $dir"
     directories: Directories = Field(default_factory=Directories)
     dismissables: DismissableContent = Field(default_factory=DismissableContent)
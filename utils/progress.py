@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import traceback
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+
+class ProgressFrame(NamedTuple):
+    task: str
+    files: int
+    total_files: int
+    bytes: int
+    total_bytes: int
+    current: Optional[str]
+    elapsed: float
+
+    @property
+    def fraction(self) -> float:
+        if self.total_bytes:
+            return min(self.bytes / self.total_bytes, 1.0)
+        if self.total_files:
+            return min(self.files / self.total_files, 1.0)
+        return 0.0
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """Seconds left, estimated from the bytes done so far."""
+        fraction = self.fraction
+        if not fraction:
+            return None
+        return self.elapsed * (1 / fraction - 1)
+
+    def describe(self) -> str:
+        remaining = self.remaining
+        return (
+            f"[{round(self.fraction * 100, 1)}%] | Elapsed: {round(self.elapsed):>3}s"
+            f" | Estimated {round(remaining) if remaining is not None else '?':>3}s"
+            " remaining"
+        )
+
+
+class ProgressBus:
+    """Progress of the running task, published by the engine and read by
+    subscribers at their own pace.
+
+    Publishing only bumps counters. Subscribers are polled at a fixed frame rate
+    and only called when something was published since their last frame, so
+    the engine runs as fast with a UI attached as without one."""
+
+    def __init__(self):
+        self.task = ""
+        self.files = 0
+        self.total_files = 0
+        self.bytes = 0
+        self.total_bytes = 0
+        self.current: Optional[str] = None
+        self.version = 0
+        self._start = perf_counter()
+
+    def start(self, task: str, total_files: int, total_bytes: int):
+        self.task = task
+        self.files = 0
+        self.total_files = total_files
+        self.bytes = 0
+        self.total_bytes = total_bytes
+        self.current = None
+        self.version += 1
+        self._start = perf_counter()
+
+    def advance(self, size: int = 0, current: Optional[str] = None, files: int = 1):
+        self.files += files
+        self.bytes += size
+        if current is not None:
+            self.current = current
+        self.version += 1
+
+    def frame(self) -> ProgressFrame:
+        return ProgressFrame(
+            self.task,
+            self.files,
+            self.total_files,
+            self.bytes,
+            self.total_bytes,
+            self.current,
+            perf_counter() - self._start,
+        )
+
+    async def watch(
+        self, callback: Callable[[ProgressFrame], Awaitable], fps: float = 10
+    ):
+        version = self.version
+        while True:
+            await asyncio.sleep(1 / fps)
+            if self.version == version:
+                continue
+            version = self.version
+            try:
+                await callback(self.frame())
+            except Exception as e:
+                print("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+
+    @asynccontextmanager
+    async def subscribe(
+        self, callback: Callable[[ProgressFrame], Awaitable], fps: float = 10
+    ):
+        watcher = asyncio.create_task(self.watch(callback, fps), name="progress")
+        try:
+            yield self
+        finally:
+            watcher.cancel()
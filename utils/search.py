@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import re
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, Optional
+
+from utils.extractor import (
+    FileStatus,
+    TFArchive,
+    TFIEntry,
+    TFIndex,
+    Totals,
+    TroveFile,
+)
+from utils.filesystem import compile_glob, normalize
+
+wildcards = re.compile(r"[*?\[]")
+statuses = tuple(FileStatus)
+
+
+class SearchResult:
+    __slots__ = ("catalog", "rows")
+
+    def __init__(self, catalog: CatalogSearch, rows: Iterable[int]):
+        self.catalog = catalog
+        self.rows = array("I", rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.catalog.paths[row] for row in self.rows)
+
+    @property
+    def size(self) -> int:
+        sizes = self.catalog.sizes
+        return sum(sizes[row] for row in self.rows)
+
+    def files(self) -> list[TroveFile]:
+        return [self.catalog.file(row) for row in self.rows]
+
+
+class ScanResult(SearchResult):
+    """Catalog rows found changed by a scan along with their status.
+
+    Only row ids and statuses are kept, payloads are sliced again from their
+    archives when extracted, so a scan holds no file or archive buffers. Totals
+    of the changed files are kept per index as rows are added."""
+
+    __slots__ = ("statuses", "changes")
+
+    def __init__(self, catalog: CatalogSearch):
+        super().__init__(catalog, ())
+        self.statuses = array("B")
+        self.changes: dict[str, Totals] = {}
+
+    def _append(self, row: int, status: int):
+        self.rows.append(row)
+        self.statuses.append(status)
+        path = self.catalog.indexes[row].relative_path
+        if path not in self.changes:
+            self.changes[path] = Totals()
+        self.changes[path].add(self.catalog.entries[row])
+
+    def add(self, row: int, status: FileStatus):
+        self._append(row, statuses.index(status))
+
+    def changed(self, index: TFIndex) -> Totals:
+        """Returns the totals of the changed files of an index."""
+        return self.changes.get(index.relative_path, Totals())
+
+    @property
+    def size(self) -> int:
+        return sum(totals.bytes for totals in self.changes.values())
+
+    def status(self, position: int) -> FileStatus:
+        return statuses[self.statuses[position]]
+
+    def sort(self):
+        records = sorted(zip(self.rows, self.statuses))
+        self.rows = array("I", (row for row, _ in records))
+        self.statuses = array("B", (status for _, status in records))
+
+    def select(self, indexes: Iterable[TFIndex]) -> ScanResult:
+        """Returns the rows belonging to the given indexes."""
+        paths = {index.relative_path for index in indexes}
+        catalog_indexes = self.catalog.indexes
+        selected = ScanResult(self.catalog)
+        for row, status in zip(self.rows, self.statuses):
+            if catalog_indexes[row].relative_path in paths:
+                selected._append(row, status)
+        return selected
+
+    def discard(self, indexes: Iterable[TFIndex]):
+        """Removes the rows belonging to the given indexes."""
+        paths = {index.relative_path for index in indexes}
+        catalog_indexes = self.catalog.indexes
+        kept = [
+            (row, status)
+            for row, status in zip(self.rows, self.statuses)
+            if catalog_indexes[row].relative_path not in paths
+        ]
+        self.rows = array("I", (row for row, _ in kept))
+        self.statuses = array("B", (status for _, status in kept))
+        for path in paths:
+            self.changes.pop(path, None)
+
+    def files(self) -> list[TroveFile]:
+        return [
+            self.catalog.file(row, self.status(position))
+            for position, row in enumerate(self.rows)
+        ]
+
+
+class CatalogSearch:
+    """Sorted array of every relative path in the catalog with a size column.
+
+    Prefix queries are answered with a binary search, glob queries narrow the
+    range with the literal prefix of the pattern before matching."""
+
+    def __init__(self):
+        self.paths: list[str] = []
+        self.sizes = array("Q")
+        self.indexes: list[TFIndex] = []
+        self.entries: list[TFIEntry] = []
+        self.totals = Totals()
+        self.index_totals: dict[str, Totals] = {}
+        self._archives: dict[tuple[str, int], TFArchive] = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    @classmethod
+    async def build(cls, indexes: Iterable[TFIndex]) -> CatalogSearch:
+        """Catalogs the files of the given indexes, leaving out the entries whose
+        archive is missing from the install."""
+        rows = []
+        catalog = cls()
+        for index in indexes:
+            directory = normalize(index.relative_directory)
+            archives = {archive.id: archive for archive in index.archives}
+            for archive_id, archive in archives.items():
+                catalog._archives[(index.relative_path, archive_id)] = archive
+            totals = Totals()
+            for entry in await index.files_list:
+                if entry.archive_index not in archives:
+                    continue
+                rows.append((normalize(f"{directory}/{entry.name}"), index, entry))
+                totals.add(entry)
+                catalog.totals.add(entry)
+            catalog.index_totals[index.relative_path] = totals
+        rows.sort(key=lambda row: row[0])
+        catalog.paths = [path for path, _, _ in rows]
+        catalog.sizes = array("Q", (entry.size for _, _, entry in rows))
+        catalog.indexes = [index for _, index, _ in rows]
+        catalog.entries = [entry for _, _, entry in rows]
+        return catalog
+
+    def file(self, row: int, status: Optional[FileStatus] = None) -> TroveFile:
+        index, entry = self.indexes[row], self.entries[row]
+        archive = self._archives[(index.relative_path, entry.archive_index)]
+        return TroveFile(archive, entry, status)
+
+    def find(self, path: str) -> Optional[int]:
+        path = normalize(path)
+        row = bisect_left(self.paths, path)
+        if row < len(self.paths) and self.paths[row] == path:
+            return row
+        return None
+
+    def _range(self, prefix: str) -> range:
+        if not prefix:
+            return range(len(self.paths))
+        start = bisect_left(self.paths, prefix)
+        end = bisect_left(self.paths, prefix[:-1] + chr(ord(prefix[-1]) + 1), start)
+        return range(start, end)
+
+    def prefix(self, prefix: str) -> SearchResult:
+        return SearchResult(self, self._range(normalize(prefix)))
+
+    def glob(self, pattern: str) -> SearchResult:
+        pattern = normalize(pattern)
+        literal = wildcards.split(pattern, 1)[0]
+        regex = compile_glob(pattern)
+        paths = self.paths
+        return SearchResult(
+            self, (row for row in self._range(literal) if regex.match(paths[row]))
+        )
+
+    def regex(self, pattern: str) -> SearchResult:
+        regex = re.compile(pattern)
+        paths = self.paths
+        return SearchResult(
+            self, (row for row in range(len(paths)) if regex.search(paths[row]))
+        )
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter_ns
+from weakref import WeakKeyDictionary
+
+
+class Tracer:
+    """Records spans as Chrome trace events, loadable in chrome://tracing or
+    Perfetto.
+
+    Every asyncio task and every thread gets its own track, so concurrent
+    stages show up side by side. Nothing is recorded unless enabled, and events
+    past max_events are only counted so a long session stays bounded."""
+
+    def __init__(self, max_events: int = 1_000_000):
+        self.enabled = False
+        self.max_events = max_events
+        self.events: list[dict] = []
+        self.dropped = 0
+        self._start = perf_counter_ns()
+        self._tasks: WeakKeyDictionary[asyncio.Task, int] = WeakKeyDictionary()
+        self._threads: dict[int, int] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def enable(self):
+        if not self.enabled:
+            self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.events.clear()
+        self.dropped = 0
+        self._start = perf_counter_ns()
+        self._tasks = WeakKeyDictionary()
+        self._threads.clear()
+        self._next_id = 1
+
+    def _record(self, event: dict):
+        if len(self.events) < self.max_events:
+            self.events.append(event)
+        else:
+            self.dropped += 1
+
+    def _track(self, name: str) -> int:
+        with self._lock:
+            track = self._next_id
+            self._next_id += 1
+        self._record(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": track,
+                "args": {"name": name},
+            }
+        )
+        return track
+
+    def _current_track(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            if task not in self._tasks:
+                self._tasks[task] = self._track(task.get_name())
+            return self._tasks[task]
+        thread = threading.current_thread()
+        if thread.ident not in self._threads:
+            self._threads[thread.ident] = self._track(thread.name)
+        return self._threads[thread.ident]
+
+    def _timestamp(self, time: int) -> float:
+        return (time - self._start) / 1000
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        if not self.enabled:
+            yield
+            return
+        track = self._current_track()
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = perf_counter_ns()
+            self._record(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": self._timestamp(start),
+                    "dur": (end - start) / 1000,
+                    "pid": os.getpid(),
+                    "tid": track,
+                    "args": args,
+                }
+            )
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w+") as f:
+            json.dump(
+                {
+                    "traceEvents": self.events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {"droppedEvents": self.dropped},
+                },
+                f,
+            )
+
+
+tracer = Tracer()
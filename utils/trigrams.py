@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+from array import array
+from pathlib import Path
+from typing import Iterable
+
+from utils.planner import ExtractionPlan
+from utils.search import CatalogSearch
+
+text_directories = ("languages/", "blueprints/", "ui/")
+
+
+def trigrams(payload: bytes) -> array:
+    payload = payload.lower()
+    return array(
+        "I",
+        sorted(
+            {
+                (a << 16) | (b << 8) | c
+                for a, b, c in zip(payload, payload[1:], payload[2:])
+            }
+        ),
+    )
+
+
+def is_text(payload: bytes) -> bool:
+    return b"\0" not in payload[:4096]
+
+
+class TrigramIndex:
+    """On-disk trigram index over the payloads of text-like files.
+
+    Every file is keyed by its catalog path and stores the size and TFI hash it
+    was indexed with, so updates only tokenize files that changed since. Queries
+    return the files holding every trigram of the text, which may still need to
+    be confirmed against the payload. Binary files are kept without postings."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(files)")
+        ]
+        if "trigrams" in columns:
+            # Indexes from before postings could be deleted by file are rebuilt
+            self.connection.executescript(
+                "DROP TABLE files; DROP TABLE IF EXISTS postings;"
+            )
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                hash INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                trigram INTEGER NOT NULL,
+                file_id INTEGER NOT NULL,
+                PRIMARY KEY (trigram, file_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_file ON postings (file_id);
+            """
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _remove(self, path: str):
+        row = self.connection.execute(
+            "SELECT id FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return
+        self.connection.execute("DELETE FROM postings WHERE file_id = ?", row)
+        self.connection.execute("DELETE FROM files WHERE id = ?", row)
+
+    def _store(self, files: Iterable[tuple[str, int, int, array]]):
+        with self.connection:
+            for path, size, hash, file_trigrams in files:
+                self._remove(path)
+                file_id = self.connection.execute(
+                    "INSERT INTO files (path, size, hash) VALUES (?, ?, ?)",
+                    (path, size, hash),
+                ).lastrowid
+                self.connection.executemany(
+                    "INSERT INTO postings VALUES (?, ?)",
+                    ((trigram, file_id) for trigram in file_trigrams),
+                )
+
+    def _prune(self, paths: Iterable[str]):
+        with self.connection:
+            for path in paths:
+                self._remove(path)
+
+    async def update(
+        self, catalog: CatalogSearch, directories: Iterable[str] = text_directories
+    ) -> tuple[int, int]:
+        """Tokenizes the files of the catalog that changed since the last update
+        and drops the ones no longer in it, returns both counts."""
+        indexed = {
+            path: (size, hash)
+            for path, size, hash in self.connection.execute(
+                "SELECT path, size, hash FROM files"
+            )
+        }
+        changed = []
+        for directory in directories:
+            for row in catalog.prefix(directory).rows:
+                path, entry = catalog.paths[row], catalog.entries[row]
+                if indexed.pop(path, None) != (entry.size, entry.hash):
+                    changed.append(row)
+        files = {}
+        for row in changed:
+            files[catalog.file(row)] = catalog.paths[row]
+        for archive_plan in ExtractionPlan(files):
+            await archive_plan.archive.content_until(archive_plan.end)
+            stored = []
+            for file in archive_plan.files:
+                payload = await file.content
+                stored.append(
+                    (
+                        files[file],
+                        file.size,
+                        file.hash,
+                        await asyncio.to_thread(trigrams, payload)
+                        if is_text(payload)
+                        else array("I"),
+                    )
+                )
+                file.release()
+            archive_plan.archive.release()
+            # Binary files are stored without postings so they are not read again
+            await asyncio.to_thread(self._store, stored)
+        await asyncio.to_thread(self._prune, indexed)
+        return len(changed), len(indexed)
+
+    def candidates(self, text: str) -> list[str]:
+        """Lists the files that may contain the text, ignoring case."""
+        query = trigrams(text.encode())
+        if not query:
+            raise ValueError("Queries need at least 3 characters.")
+        rows = self.connection.execute(
+            f"""
+            SELECT files.path FROM postings
+            JOIN files ON files.id = postings.file_id
+            WHERE postings.trigram IN ({", ".join("?" * len(query))})
+            GROUP BY postings.file_id HAVING COUNT(*) = ?
+            ORDER BY files.path
+            """,
+            (*query, len(query)),
+        )
+        return [path for path, in rows]
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+
+class DirectoryWalker:
+    """Finds files by name using os.scandir, remembering the directory layout.
+
+    Each visited directory is cached with its mtime, whether it holds the looked
+    for file and its subdirectories. A directory whose mtime didn't change since
+    the last walk is not listed again, only its subdirectories get checked."""
+
+    version = 1
+
+    def __init__(self, look_for: str, cache_path: Optional[Path] = None):
+        self.look_for = look_for
+        self.cache_path = cache_path
+        self.layout: dict[str, list] = {}
+        self.load()
+
+    def load(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return
+        try:
+            data = json.loads(self.cache_path.read_text())
+        except (OSError, json.JSONDecodeError):
+            print("Failed to load directory cache, malformed file.")
+            return
+        if data.get("version") != self.version or data.get("look_for") != self.look_for:
+            return
+        self.layout = data.get("layout", {})
+
+    def save(self):
+        if self.cache_path is None:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "version": self.version,
+            "look_for": self.look_for,
+            "layout": self.layout,
+        }
+        self.cache_path.write_text(json.dumps(data, separators=(",", ":")))
+
+    def _walk(self, directory: str, layout: dict, found: list):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        cached = self.layout.get(directory)
+        if cached is None or cached[0] != mtime:
+            has_file = False
+            directories = []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(entry.name)
+                        elif entry.name == self.look_for:
+                            has_file = True
+            except OSError:
+                return
+            cached = [mtime, has_file, directories]
+        layout[directory] = cached
+        if cached[1]:
+            found.append(os.path.join(directory, self.look_for))
+        for name in cached[2]:
+            self._walk(os.path.join(directory, name), layout, found)
+
+    def _walk_tree(self, directory: str) -> tuple[dict, list]:
+        layout, found = {}, []
+        self._walk(directory, layout, found)
+        return layout, found
+
+    async def find(self, root: Path, directories: list[str]) -> list[Path]:
+        tops = [os.path.join(root, directory) for directory in directories]
+        results = await asyncio.gather(
+            *[asyncio.to_thread(self._walk_tree, top) for top in tops]
+        )
+        prefixes = tuple(top + os.sep for top in tops)
+        for key in list(self.layout):
+            if key in tops or key.startswith(prefixes):
+                del self.layout[key]
+        found = []
+        for layout, files in results:
+            self.layout.update(layout)
+            found.extend(files)
+        self.save()
+        return [Path(file) for file in sorted(found)]